@@ -1,14 +1,18 @@
 
 # -*- coding: utf-8 -*-
+import os
 import time
 from email.utils import parsedate_tz, mktime_tz
 
 from PyQt5 import QtCore
 from PyQt5.QtGui import QIcon, QIntValidator
 from PyQt5.QtWidgets import ( QDialog, QDialogButtonBox, QGridLayout, QLineEdit, QSpinBox,
-    QLabel, QVBoxLayout, QPushButton, QTableWidget, QTableWidgetItem, QHeaderView, QCheckBox
+    QLabel, QVBoxLayout, QPushButton, QTableWidget, QTableWidgetItem, QHeaderView, QCheckBox,
+    QHBoxLayout, QListWidget, QFileDialog
 )
 
+from library_index import LibraryIndex, LibraryIndexer
+
 class ExportToImageDialog(QDialog):
     def __init__(self, page_no, total_pages, parent):
         QDialog.__init__(self, parent)
@@ -79,6 +83,115 @@ class DocInfoDialog(QDialog):
             self.tableWidget.setItem(i,0, QTableWidgetItem(key))
             self.tableWidget.setItem(i,1, QTableWidgetItem(val))
 
+
+class LibrarySearchDialog(QDialog):
+    """ searches words in all pdf files of library folders. index is updated
+    in background whenever the dialog is shown or folders are changed """
+    hitActivated = QtCore.pyqtSignal(str, int, str)# filename, page_no, query
+
+    def __init__(self, index_dir, folders, parent):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle('Search Library')
+        self.resize(640, 480)
+        self.folders = list(folders)
+        self.index = LibraryIndex(index_dir)
+        self.indexer = LibraryIndexer(self, index_dir)
+        self.searchEdit = QLineEdit(self)
+        self.searchEdit.setPlaceholderText("Words to search, e.g XK-110 or XK-1*")
+        self.tableWidget = QTableWidget(0, 3, self)
+        self.tableWidget.setHorizontalHeaderLabels(["File", "Page", "Folder"])
+        self.tableWidget.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.tableWidget.setSelectionBehavior(QTableWidget.SelectRows)
+        self.tableWidget.verticalHeader().setVisible(False)
+        self.tableWidget.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeToContents)
+        self.tableWidget.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        self.tableWidget.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.statusLabel = QLabel(self)
+        self.foldersList = QListWidget(self)
+        self.foldersList.setMaximumHeight(80)
+        self.foldersList.addItems(self.folders)
+        addFolderBtn = QPushButton("Add Folder", self)
+        removeFolderBtn = QPushButton("Remove Folder", self)
+        updateBtn = QPushButton("Update Index", self)
+        vLayout = QVBoxLayout(self)
+        vLayout.addWidget(self.searchEdit)
+        vLayout.addWidget(self.tableWidget)
+        vLayout.addWidget(self.statusLabel)
+        vLayout.addWidget(QLabel("Library Folders :", self))
+        vLayout.addWidget(self.foldersList)
+        hLayout = QHBoxLayout()
+        hLayout.addWidget(addFolderBtn)
+        hLayout.addWidget(removeFolderBtn)
+        hLayout.addStretch()
+        hLayout.addWidget(updateBtn)
+        vLayout.addLayout(hLayout)
+        # connect signals
+        self.searchEdit.textChanged.connect(self.search)
+        self.tableWidget.cellActivated.connect(self.onHitActivated)
+        addFolderBtn.clicked.connect(self.addFolder)
+        removeFolderBtn.clicked.connect(self.removeFolder)
+        updateBtn.clicked.connect(self.updateIndex)
+        self.indexer.progressChanged.connect(self.onIndexProgress)
+        self.indexer.indexSaved.connect(self.onIndexSaved)
+        self.indexer.finished.connect(self.onIndexFinished)
+        self.hits = []
+        self.showIndexStatus()
+
+    def search(self):
+        query = self.searchEdit.text()
+        start = time.perf_counter()
+        self.hits = self.index.search(query) if query.strip() else []
+        elapsed = time.perf_counter() - start
+        self.tableWidget.setRowCount(len(self.hits))
+        for row, (filename, page_no) in enumerate(self.hits):
+            folder, name = os.path.split(filename)
+            self.tableWidget.setItem(row, 0, QTableWidgetItem(name))
+            self.tableWidget.setItem(row, 1, QTableWidgetItem(str(page_no)))
+            self.tableWidget.setItem(row, 2, QTableWidgetItem(folder))
+        if query.strip() and not self.indexer.isRunning():
+            docs = len(set(filename for filename, page_no in self.hits))
+            self.statusLabel.setText("%i pages in %i files (%.1f ms)" % (len(self.hits), docs, elapsed*1000))
+
+    def onHitActivated(self, row, col):
+        filename, page_no = self.hits[row]
+        self.hitActivated.emit(filename, page_no, self.searchEdit.text())
+
+    def addFolder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Select Library Folder")
+        if not folder or folder in self.folders:
+            return
+        self.folders.append(folder)
+        self.foldersList.addItem(folder)
+        self.updateIndex()
+
+    def removeFolder(self):
+        row = self.foldersList.currentRow()
+        if row<0:
+            return
+        self.folders.pop(row)
+        self.foldersList.takeItem(row)
+        self.updateIndex()
+
+    def updateIndex(self):
+        """ restarts indexing, so that changed folders are used """
+        self.indexer.stop()
+        self.indexer.start(self.folders)
+
+    def showIndexStatus(self):
+        self.statusLabel.setText("%i files indexed" % self.index.documentCount())
+
+    def onIndexProgress(self, done, total):
+        self.statusLabel.setText("Indexing : %i/%i files" % (done, total))
+
+    def onIndexSaved(self):
+        self.index.load()
+        self.search()
+
+    def onIndexFinished(self, success):
+        self.index.load()
+        self.showIndexStatus()
+        self.search()
+
 # Takes D:20130501200439+01'00' like format and returns a local timezone based format
 # In some pdfs date does not start with D:
 def parsePdfTime(t):
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Filters applied on rendered pages in worker threads.
+# These work on image data in place using numpy, which is imported only
+# when a filter is applied, so that it does not slow down startup.
+import importlib.util
+
+from PyQt5.QtGui import QImage
+
+
+class ImageBuffer:
+    """ exposes QImage data to numpy, and keeps the image alive while
+    the array exists. Other than Grayscale8 and 32 bit formats, images are
+    converted to RGB32 if readonly, otherwise ValueError is raised. """
+    formats = (QImage.Format_Grayscale8, QImage.Format_RGB32, QImage.Format_ARGB32,
+                QImage.Format_ARGB32_Premultiplied)
+
+    def __init__(self, image, readonly=True):
+        if image.format() not in self.formats:
+            if not readonly:
+                raise ValueError("unsupported image format %i" % image.format())
+            image = image.convertToFormat(QImage.Format_RGB32)
+        self.image = image
+        if image.format()==QImage.Format_Grayscale8:
+            shape, strides = (image.height(), image.width()), (image.bytesPerLine(), 1)
+        else:
+            shape, strides = (image.height(), image.width(), 4), (image.bytesPerLine(), 4, 1)
+        data = image.constBits() if readonly else image.bits()
+        self.__array_interface__ = {"shape": shape, "strides": strides, "typestr": "|u1",
+                    "data": (int(data), readonly), "version": 3}
+
+
+def imageArray(image, readonly=True):
+    """ returns numpy array which uses the QImage data without copying.
+    shape is (height, width) for Grayscale8 and (height, width, 4) for 32 bit images.
+    32 bit images are in BGRA byte order on little endian machines. """
+    import numpy
+    return numpy.asarray(ImageBuffer(image, readonly))
+
+
+def filtersAvailable():
+    return importlib.util.find_spec("numpy") is not None
+
+
+def darkMode(arr):
+    """ inverts lightness, but keeps hue of colored regions """
+    import numpy
+    if arr.ndim==2:
+        numpy.subtract(255, arr, out=arr)
+        return
+    rgb = arr[..., :3]
+    shift = 255 - rgb.max(axis=2).astype(numpy.int16) - rgb.min(axis=2)
+    rgb[:] = numpy.clip(rgb + shift[..., None], 0, 255)
+
+def highContrast(arr):
+    """ stretches levels, so that faded scans become darker """
+    import numpy
+    channels = arr if arr.ndim==2 else arr[..., :3]
+    lo, hi = numpy.percentile(channels[::4, ::4], (1, 99))
+    if hi-lo < 16:# blank page
+        return
+    lut = numpy.clip((numpy.arange(256)-lo)*255/(hi-lo), 0, 255).astype(numpy.uint8)
+    channels[:] = lut[channels]
+
+def sepia(arr):
+    import numpy
+    bgr = arr[..., :3].astype(numpy.float32)
+    matrix = numpy.array([[0.131, 0.534, 0.272],
+                          [0.168, 0.686, 0.349],
+                          [0.189, 0.769, 0.393]], numpy.float32)
+    arr[..., :3] = numpy.clip(bgr @ matrix.T, 0, 255)
+
+
+# name : (title, function, requires color image)
+filters = {
+    "dark" : ("Dark Mode", darkMode, False),
+    "contrast" : ("High Contrast", highContrast, False),
+    "sepia" : ("Sepia", sepia, True),
+}
+
+def registerFilter(name, title, func, color=False):
+    """ func takes a numpy array returned by imageArray() and modifies it in place """
+    filters[name] = (title, func, color)
+
+
+def applyFilter(image, name):
+    """ returns a filtered copy of the image. name "none" returns the image """
+    if name not in filters:
+        return image
+    title, func, color = filters[name]
+    if image.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32_Premultiplied,
+                    QImage.Format_Grayscale8) or (color and image.format()==QImage.Format_Grayscale8):
+        image = image.convertToFormat(QImage.Format_RGB32)
+    else:
+        image = image.copy()
+    func(imageArray(image, readonly=False))
+    return image
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is a part of PDF Bunny Program which is GNU GPLv3 licensed
+""" Full text index of all PDFs in library folders.
+
+Index is updated by running this file in a separate process :
+    python3 library_index.py INDEX_DIR FOLDER...
+In frozen (pyinstaller) build, the viewer program is run instead :
+    pdf_bunny --update-library-index INDEX_DIR FOLDER...
+Text of new and modified files (detected by mtime and size) is extracted
+by a pool of processes, and the index is saved every few hundred files.
+
+INDEX_DIR contains two files :
+files.json : {"version" : 1, "generation" : N, "files" : [[path, mtime_ns, size, page_count], ...]}
+    list index is doc_no. removed or modified files are replaced by null, and
+    a new file is always appended. When more than a quarter of entries are null,
+    they are dropped and doc_nos of remaining files are renumbered.
+index.bin : header, sorted terms joined by newline, postings offsets, postings
+    header is MAGIC, term count, length of terms text and generation (uint64s).
+    generation is same in both files when saved together, so that a reader
+    does not use files of one save with postings of another.
+    offsets are uint64 array of term count + 1 items.
+    posting of a term has an entry for each document containing the term,
+    entry = varint doc_no, varint page count, varint deltas of sorted page_nos
+"""
+import sys, os
+import re
+import json
+import time
+import signal
+import bisect
+from array import array
+
+from PyQt5.QtCore import QObject, QProcess, pyqtSignal
+
+MAGIC = b"PBLIBIX2"
+SAVE_INTERVAL = 200 # no. of files extracted between saves
+MAX_TERM_LENGTH = 64
+MAX_PREFIX_TERMS = 1000 # terms matched by a prefix query
+
+
+def tokenize(text):
+    """ returns lowercase words. part numbers like XK-110 or 3.5/A are kept whole """
+    return [word for word in re.findall(r"\w[\w\-./]*\w|\w", text.lower()) if len(word)<=MAX_TERM_LENGTH]
+
+def pageTerms(text):
+    """ returns set of terms of a page. parts of words joined by -./ are
+    also added, so that XK-110 is found by XK or 110 too """
+    terms = set()
+    for word in tokenize(text):
+        terms.add(word)
+        if not word.isalnum():
+            terms.update(part for part in re.split(r"[\-./]", word) if part)
+    return terms
+
+
+def encodeVarint(value, buf):
+    while value>=0x80:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+def decodePosting(data):
+    """ returns list of (doc_no, [page_nos]) of an encoded posting """
+    entries = []
+    values = []
+    value, shift = 0, 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(value)
+        value, shift = 0, 0
+        # entry is complete when all its page deltas are read
+        if len(values)>=2 and len(values)==values[1]+2:
+            page_nos, page_no = [], 0
+            for delta in values[2:]:
+                page_no += delta
+                page_nos.append(page_no)
+            entries.append((values[0], page_nos))
+            values = []
+    return entries
+
+def encodeEntry(doc_no, page_nos, buf):
+    encodeVarint(doc_no, buf)
+    encodeVarint(len(page_nos), buf)
+    prev = 0
+    for page_no in page_nos:
+        encodeVarint(page_no-prev, buf)
+        prev = page_no
+
+
+
+class LibraryIndex:
+    """ Read only view of the index saved by updateIndex() """
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.files = []
+        self.terms = []
+        self.offsets = array("Q")
+        self.postings_start = 0
+        self.file = None
+        self.load()
+
+    def load(self):
+        """ (re)loads the index from disk. missing index is loaded as empty """
+        self.close()
+        # files may be replaced while being loaded, then it is loaded again
+        for i in range(3):
+            try:
+                with open(os.path.join(self.index_dir, "files.json")) as f:
+                    info = json.load(f)
+                files, generation = info["files"], info["generation"]
+                f = open(os.path.join(self.index_dir, "index.bin"), "rb")
+            except (OSError, ValueError, KeyError):
+                return
+            header = f.read(len(MAGIC)+24)
+            if header[:len(MAGIC)]!=MAGIC or len(header)<len(MAGIC)+24:
+                f.close()
+                return
+            count, terms_len, index_generation = array("Q", header[len(MAGIC):])
+            if index_generation==generation:
+                break
+            f.close()
+            time.sleep(0.05)
+        else:
+            return
+        self.terms = f.read(terms_len).decode().split("\n") if count else []
+        self.offsets = array("Q")
+        self.offsets.frombytes(f.read(8*(count+1)))
+        self.postings_start = f.tell()
+        self.files, self.file = files, f
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        self.file = None
+        self.files, self.terms = [], []
+
+    def documentCount(self):
+        return len([x for x in self.files if x])
+
+    def posting(self, i):
+        """ returns {doc_no : set(page_nos)} of i-th term """
+        self.file.seek(self.postings_start + self.offsets[i])
+        data = self.file.read(self.offsets[i+1]-self.offsets[i])
+        return {doc_no: set(page_nos) for doc_no,page_nos in decodePosting(data)}
+
+    def lookup(self, word, prefix=False):
+        """ returns {doc_no : set(page_nos)} of pages containing the word """
+        start = bisect.bisect_left(self.terms, word)
+        if not prefix:
+            return self.posting(start) if start<len(self.terms) and self.terms[start]==word else {}
+        result = {}
+        for i in range(start, min(start+MAX_PREFIX_TERMS, len(self.terms))):
+            if not self.terms[i].startswith(word):
+                break
+            for doc_no, page_nos in self.posting(i).items():
+                result.setdefault(doc_no, set()).update(page_nos)
+        return result
+
+    def search(self, query, max_hits=1000):
+        """ returns list of (filename, page_no) of pages containing all words
+        of the query. word ending with * matches words starting with it.
+        documents having more matching pages come first """
+        if not self.file:
+            return []
+        result = None
+        for chunk in query.split():
+            prefix = chunk.endswith("*")
+            for word in tokenize(chunk):
+                pages = self.lookup(word, prefix)
+                if result is None:
+                    result = pages
+                else:
+                    result = {doc_no: result[doc_no] & page_nos for doc_no,page_nos in pages.items()
+                                if doc_no in result and result[doc_no] & page_nos}
+                if not result:
+                    return []
+        if not result:
+            return []
+        docs = [(doc_no, page_nos) for doc_no,page_nos in result.items()
+                    if doc_no<len(self.files) and self.files[doc_no]]
+        docs.sort(key=lambda x: (-len(x[1]), self.files[x[0]][0]))
+        hits = []
+        for doc_no, page_nos in docs:
+            hits += [(self.files[doc_no][0], page_no) for page_no in sorted(page_nos)]
+            if len(hits)>=max_hits:
+                break
+        return hits[:max_hits]
+
+
+
+def scanFolders(folders):
+    """ returns {path : (mtime_ns, size)} of all pdf files in folders """
+    result = {}
+    for folder in folders:
+        for dirpath, dirnames, filenames in os.walk(os.path.expanduser(folder)):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            for name in filenames:
+                if not name.lower().endswith(".pdf"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                result[path] = (st.st_mtime_ns, st.st_size)
+    return result
+
+def extractTerms(path):
+    """ returns (path, page_count, {term : [page_nos]}). locked and broken files
+    have no terms, so that they are not tried again until modified """
+    from pdf_lib import PdfDocument
+    terms, page_count = {}, 0
+    try:
+        doc = PdfDocument(path)
+        if doc.isValid() and not doc.isLocked():
+            page_count = doc.pageCount()
+            for page_no in range(1, page_count+1):
+                for term in pageTerms(" ".join(doc.textLayer(page_no).words)):
+                    terms.setdefault(term, []).append(page_no)
+    except Exception:
+        pass
+    return path, page_count, terms
+
+
+def loadPostings(index_dir):
+    """ returns files list and {term : bytearray posting} of saved index """
+    index = LibraryIndex(index_dir)
+    postings = {}
+    if index.file:
+        index.file.seek(index.postings_start)
+        data = index.file.read()
+        offsets = index.offsets
+        for i,term in enumerate(index.terms):
+            postings[term] = bytearray(data[offsets[i]:offsets[i+1]])
+    files = index.files
+    index.close()
+    return files, postings
+
+def compactPostings(files, postings):
+    """ removes entries of removed and modified files, and renumbers doc_nos
+    of remaining files. returns the new files list without null entries """
+    new_doc_nos = {}
+    for doc_no, entry in enumerate(files):
+        if entry:
+            new_doc_nos[doc_no] = len(new_doc_nos)
+    for term in list(postings.keys()):
+        buf = bytearray()
+        # order of entries is kept, as doc_nos are renumbered in same order
+        for doc_no, page_nos in decodePosting(postings[term]):
+            if doc_no in new_doc_nos:
+                encodeEntry(new_doc_nos[doc_no], page_nos, buf)
+        if buf:
+            postings[term] = buf
+        else:
+            del postings[term]
+    return [entry for entry in files if entry]
+
+def saveIndex(index_dir, files, postings):
+    """ index.bin is replaced before files.json. a reader which loads files.json
+    of previous save finds a different generation in index.bin, and loads again """
+    generation = time.time_ns()
+    terms = sorted(postings.keys())
+    offsets = array("Q", [0])
+    for term in terms:
+        offsets.append(offsets[-1] + len(postings[term]))
+    terms_text = "\n".join(terms).encode()
+    tmp_file = os.path.join(index_dir, "index.bin.tmp")
+    with open(tmp_file, "wb") as f:
+        f.write(MAGIC + array("Q", [len(terms), len(terms_text), generation]).tobytes())
+        f.write(terms_text)
+        f.write(offsets.tobytes())
+        for term in terms:
+            f.write(postings[term])
+    os.replace(tmp_file, os.path.join(index_dir, "index.bin"))
+    tmp_file = os.path.join(index_dir, "files.json.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump({"version": 1, "generation": generation, "files": files}, f)
+    os.replace(tmp_file, os.path.join(index_dir, "files.json"))
+
+def updateIndex(index_dir, folders, processes=None):
+    """ indexes new and modified pdf files in folders, and removes deleted files.
+    prints "progress DONE TOTAL" and "saved" lines for LibraryIndexer """
+    from multiprocessing import Pool
+    os.makedirs(index_dir, exist_ok=True)
+    files, postings = loadPostings(index_dir)
+    on_disk = scanFolders(folders)
+    known, removed = {}, 0
+    for doc_no, entry in enumerate(files):
+        if not entry:
+            continue
+        if tuple(entry[1:3])==on_disk.get(entry[0]):
+            known[entry[0]] = doc_no
+        else:
+            files[doc_no] = None
+            removed += 1
+    dead_count = len([x for x in files if not x])
+    compact = dead_count > len(files)/4
+    if compact:
+        files = compactPostings(files, postings)
+    changed = sorted(path for path in on_disk if path not in known)
+    print("progress 0 %i" % len(changed), flush=True)
+    if not changed:
+        if removed or compact or not os.path.exists(os.path.join(index_dir, "index.bin")):
+            saveIndex(index_dir, files, postings)
+            print("saved", flush=True)
+        return
+    processes = processes or max((os.cpu_count() or 2)//2, 1)
+    last_save = 0
+    with Pool(processes, maxtasksperchild=50) as pool:
+        for i, (path, page_count, terms) in enumerate(pool.imap_unordered(extractTerms, changed), 1):
+            doc_no = len(files)
+            files.append([path, on_disk[path][0], on_disk[path][1], page_count])
+            for term, page_nos in terms.items():
+                encodeEntry(doc_no, page_nos, postings.setdefault(term, bytearray()))
+            print("progress %i %i" % (i, len(changed)), flush=True)
+            if i-last_save>=SAVE_INTERVAL:
+                saveIndex(index_dir, files, postings)
+                print("saved", flush=True)
+                last_save = i
+    saveIndex(index_dir, files, postings)
+    print("saved", flush=True)
+
+
+
+class LibraryIndexer(QObject):
+    """ runs updateIndex() in a separate process """
+    progressChanged = pyqtSignal(int, int)# done, total
+    indexSaved = pyqtSignal()
+    finished = pyqtSignal(bool)# success
+
+    def __init__(self, parent, index_dir):
+        QObject.__init__(self, parent)
+        self.index_dir = index_dir
+        self.process = None
+
+    def isRunning(self):
+        return self.process is not None
+
+    def start(self, folders):
+        if self.process or not folders:
+            return
+        self.process = QProcess(self)
+        self.process.readyReadStandardOutput.connect(self.onProcessOutput)
+        self.process.finished.connect(self.onProcessFinished)
+        # in frozen build, sys.executable is the viewer and this file is not on disk
+        if getattr(sys, "frozen", False):
+            args = ["--update-library-index", self.index_dir] + folders
+        else:
+            args = [os.path.abspath(__file__), self.index_dir] + folders
+        self.process.start(sys.executable, args)
+
+    def stop(self):
+        """ stops updating. files indexed till last save are kept """
+        if not self.process:
+            return
+        self.process.terminate()
+        if not self.process.waitForFinished(2000):
+            self.process.kill()
+            self.process.waitForFinished(1000)
+
+    def onProcessOutput(self):
+        while self.process and self.process.canReadLine():
+            line = bytes(self.process.readLine()).decode(errors="ignore").split()
+            if len(line)==3 and line[0]=="progress":
+                self.progressChanged.emit(int(line[1]), int(line[2]))
+            elif line==["saved"]:
+                self.indexSaved.emit()
+
+    def onProcessFinished(self, exit_code, exit_status):
+        self.onProcessOutput()
+        self.process.deleteLater()
+        self.process = None
+        self.finished.emit(exit_status==QProcess.NormalExit and exit_code==0)
+
+
+
+def main(args=None):
+    """ args are INDEX_DIR FOLDER..., sys.argv[1:] by default """
+    args = sys.argv[1:] if args is None else args
+    if len(args)<2:
+        print("usage : library_index.py INDEX_DIR FOLDER...")
+        sys.exit(1)
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    # indexing must not slow down the viewer
+    if hasattr(os, "nice"):
+        os.nice(10)
+    # pool processes are terminated when the viewer stops indexing
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    index_dir = args[0]
+    os.makedirs(index_dir, exist_ok=True)
+    try:
+        import fcntl
+        lock_file = open(os.path.join(index_dir, "lock"), "w")
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except ImportError:
+        pass
+    except OSError:
+        print("index is being updated by another process")
+        return
+    start = time.monotonic()
+    updateIndex(index_dir, args[1:])
+    print("finished in %.1f sec" % (time.monotonic()-start))
+
+
+if __name__ == "__main__":
+    from multiprocessing import freeze_support
+    freeze_support()
+    main()
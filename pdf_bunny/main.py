@@ -4,30 +4,45 @@
 # Copyright (C) 2017-2026 Arindam Chaudhuri <arindamsoft94@gmail.com>
 
 import sys, os
+import re
+import json
+import math
+import time
+import zlib
+import ctypes
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import partial
+from multiprocessing import freeze_support
 from subprocess import Popen
-from shutil import which
+from shutil import which, rmtree
 from PyQt5.QtCore import ( Qt, qVersion, QObject, pyqtSignal, QRectF, QPoint, QSettings,
-    QTimer, QThread, QEventLoop, QDir, QUrl )
-from PyQt5.QtGui import ( QPainter, QColor, QPixmap, QImage, QIcon, QStandardItem,
-    QIntValidator, QStandardItemModel, QDesktopServices
+    QTimer, QThread, QEventLoop, QDir, QUrl, QFileSystemWatcher, QSize, QProcess, QEvent )
+from PyQt5.QtGui import ( QPainter, QColor, QImage, QPixmap, QIcon, QStandardItem,
+    QIntValidator, QStandardItemModel, QDesktopServices, QPixmapCache
 )
 from PyQt5.QtWidgets import (
-    QApplication, QMainWindow, QWidget, QFrame, QAction,
+    QApplication, QMainWindow, QWidget, QFrame, QAction, QActionGroup, QTabBar,
     QVBoxLayout, QGridLayout,
     QLabel, QMessageBox, QSystemTrayIcon,
     QLineEdit, QComboBox, QRadioButton, QHeaderView,
-    QDialog, QFileDialog, QInputDialog,
+    QDockWidget, QListWidget, QListWidgetItem, QListView,
+    QDialog, QFileDialog, QInputDialog, QProgressDialog,
 )
 from PyQt5.QtPrintSupport import QPrintDialog, QPrinter
+from PyQt5.QtNetwork import QLocalServer, QLocalSocket
 
 sys.path.append(os.path.dirname(__file__)) # for enabling python 2 like import
 
 import resources_rc
 from __init__ import __version__, COPYRIGHT_YEAR, AUTHOR_NAME, AUTHOR_EMAIL
 from ui_mainwindow import Ui_window
-from dialogs import ExportToImageDialog, DocInfoDialog
-from pdf_lib import PdfDocument, backend, backend_version
+from dialogs import ExportToImageDialog, DocInfoDialog, LibrarySearchDialog
+from pdf_lib import ( PdfDocument, backend, backend_versions, availableBackends,
+    loadBackend, fastestBackend, readFile, backendWithCapability, TextLayer )
 from plugin_manager import loadPlugins
+from image_filters import filters, filtersAvailable, applyFilter
 
 
 DEBUG = False
@@ -36,6 +51,23 @@ def debug(*args):
 
 SCREEN_DPI = 100
 HOMEDIR = os.path.expanduser("~")
+# one server per user, so that users on a shared machine do not get each other's files
+# local socket name must be unique for each user. XDG_RUNTIME_DIR is private
+# to user, otherwise socket is created in shared /tmp
+if os.environ.get("XDG_RUNTIME_DIR"):
+    SERVER_NAME = os.path.join(os.environ["XDG_RUNTIME_DIR"], "pdf-bunny")
+elif hasattr(os, "getuid"):
+    SERVER_NAME = "pdf-bunny-%i" % os.getuid()
+else:
+    SERVER_NAME = "pdf-bunny-" + os.path.basename(HOMEDIR)
+THUMBNAIL_WIDTH = 120
+CACHE_DIR = os.path.join(HOMEDIR, ".cache", "pdf-bunny")
+THUMBNAIL_DIR = os.path.join(CACHE_DIR, "thumbnails")
+RENDER_COST_DIR = os.path.join(CACHE_DIR, "render-costs")
+LIBRARY_INDEX_DIR = os.path.join(CACHE_DIR, "library-index")
+# pages which take longer than this are rendered as draft first, and in advance
+SLOW_RENDER_TIME = 0.5
+SEARCH_CHUNK_PAGES = 20 # max pages searched in one job
 
 #pt2pixel = lambda point, dpi : dpi*point/72.0
 
@@ -44,155 +76,930 @@ class App:
     window = None
     plugins = []
     manager = None
+    documents = [] # opened documents, in order of tabs
+    document = None # document of current tab
+    # these are of current document
     doc = None
     filename = ''
     passwd = ''
     page_dpis = {}
 
 
-class Worker(QObject):
-    renderFinished = pyqtSignal(int, QImage, int)
-    searchFinished = pyqtSignal(int, list)
+class Document:
+    """ An opened document and its view state. Each tab has one Document """
+    last_id = 0
+
+    def __init__(self, doc, filename, password):
+        self.id = Document.newId() # used by workers to identify the document
+        self.doc = doc
+        self.filename = filename
+        self.passwd = password
+        self.pages_count = doc.pageCount()
+        self.page_sizes = [doc.pageSize(i) for i in range(1, self.pages_count+1)]
+        self.has_attachments = bool(doc.hasEmbeddedFiles())
+        self.page_dpis = {} # dpis at which pages are rendered
+        self.display_dpis = {} # dpis at which page widgets are shown
+        self.page_layout = None # zoom and viewport width for which page_dpis are calculated
+        self.render_cache = {} #{page_no:QImage} dictionary
+        # rendered images of other page filters. "none" has unfiltered images
+        self.filter_caches = {} #{filter_name : {page_no:QImage}} dictionary
+        # compressed images of pages removed from render_cache, least recent first
+        self.warm_cache = OrderedDict() #{page_no : (packed_image, dpi, color_mode, filter_name)}
+        self.frame = None
+        self.pages = [] # page widgets
+        self.curr_page_no = 1
+        self.jumped_from = None
+        self.scroll_pos = (0,0)
+        self.outline_model = None
+        self.fingerprints = None # list of page content hashes, for auto reload
+        self.file_stat = os.stat(filename)
+        self.thumbnails = {} #{page_no:QImage} dictionary
+        self.render_costs = {} #{page_no : seconds to render at 72 dpi} dictionary
+        self.failed_pages = {} #{page_no : error} pages which could not be rendered
+        self.timed_out_pages = {} #{page_no : seconds} longer time limit of pages timed out once
+
+    def cacheKey(self):
+        """ returns a name for files cached on disk, which changes when file is modified """
+        st = self.file_stat
+        key = "%s:%i:%i" % (self.filename, st.st_mtime_ns, st.st_size)
+        return hashlib.md5(key.encode()).hexdigest()
+
+    @staticmethod
+    def newId():
+        Document.last_id += 1
+        return Document.last_id
+
+
+class TextLayerCache:
+    """ Thread safe LRU cache of TextLayers, shared by all workers.
+    key is (doc_id, page_no) tuple. reloaded document gets a new id, so text
+    extracted from previous version of file is not used """
+    def __init__(self, max_size=200):
+        self.max_size = max_size
+        self.layers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            layer = self.layers.get(key, None)
+            if layer:
+                self.layers.move_to_end(key)
+            return layer
+
+    def put(self, key, layer):
+        with self.lock:
+            self.layers[key] = layer
+            if len(self.layers)>self.max_size:
+                self.layers.popitem(last=False)
+
+    def remove(self, key):
+        with self.lock:
+            self.layers.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.layers.clear()
+
+    def reloadDocument(self, old_id, new_id, page_nos):
+        """ layers of page_nos are kept for new id of reloaded document """
+        with self.lock:
+            for key in [key for key in self.layers if key[0]==old_id]:
+                layer = self.layers.pop(key)
+                if key[1] in page_nos:
+                    self.layers[(new_id, key[1])] = layer
+
 
-    def __init__(self):
+class Worker(QObject):
+    renderFinished = pyqtSignal(int, int, QImage, int, str, str, QImage)# doc_id, page_no, image, dpi, color_mode, filter_name, unfiltered image
+    searchFinished = pyqtSignal(int, int, list)# doc_id, page_no, areas
+    searchContinued = pyqtSignal(int, str, int, int)# doc_id, text, next page_no, direction
+    textLayerFinished = pyqtSignal(int, int, object)# doc_id, page_no, layer
+    fingerprintsFinished = pyqtSignal(int, list, object)# doc_id, fingerprints, file data
+    renderTimed = pyqtSignal(int, int, int, float)# doc_id, page_no, dpi, seconds
+    thumbnailFinished = pyqtSignal(int, int, QImage)# doc_id, page_no, image
+    taskFinished = pyqtSignal(int, object)# task_id, result
+    compressFinished = pyqtSignal(int, int, object, int, str, str)# doc_id, page_no, packed image, dpi, color_mode, filter_name
+    jobFailed = pyqtSignal(str)# error message
+
+    def __init__(self, text_cache):
         QObject.__init__(self)
-        self.doc = None
-        self.link_color = QColor(0,0,127, 40)
-
-    def loadDocument(self, filename, password=''):
-        """ Main thread uses this slot to load document for rendering """
-        self.doc = PdfDocument(filename)
-        if self.doc.isLocked():
-            self.doc.unlock(password)
-
-    def render(self, worker, page_no, dpi):
-        """ render(int, int)
-        This slot takes page no. and dpi and renders that page, then emits a signal with QImage"""
+        self.docs = {} # {doc_id : PdfDocument} of all opened documents
+        self.text_cache = text_cache
+
+    def loadDocument(self, doc_id, filename, password='', backend_name='', data=None):
+        """ Main thread uses this slot to load document for rendering.
+        data is the file content already read by main thread """
+        doc = PdfDocument(filename, backend_name, data)
+        if doc.isLocked():
+            doc.unlock(password)
+        self.docs[doc_id] = doc
+
+    def loadDocuments(self, worker, documents):
+        """ loads documents opened before this worker was created """
         if worker!=self:
             return
-        img = self.doc.renderPage(page_no, dpi)
-        # Add Heighlight over Link Annotation
-        painter = QPainter(img)
-        annots = self.doc.pageLinkAnnotations(page_no)
-        for subtype,rect,data in annots:
-            x,y,w,h = [x*dpi/72 for x in rect]
-            painter.fillRect(QRectF(x, y, w+1, h+1), self.link_color)
-        painter.end()
-        self.renderFinished.emit(page_no, img, dpi)
+        for args in documents:
+            self.loadDocument(*args)
+
+    def closeDocument(self, doc_id):
+        self.docs.pop(doc_id, None)
+
+    def getTextLayer(self, doc_id, page_no):
+        """ returns cached text layer, extracts it if not cached """
+        key = (doc_id, page_no)
+        layer = self.text_cache.get(key)
+        if not layer:
+            layer = self.docs[doc_id].textLayer(page_no)
+            self.text_cache.put(key, layer)
+        return layer
+
+    def loadTextLayer(self, worker, doc_id, page_no):
+        if worker!=self:
+            return
+        try:
+            self.textLayerFinished.emit(doc_id, page_no, self.getTextLayer(doc_id, page_no))
+        except Exception as e:
+            self.jobFailed.emit(repr(e))
+
+    def render(self, worker, doc_id, page_no, dpi, color_mode, filter_name, raw, draft):
+        """ render(int, int, int, str, str, QImage, bool)
+        This slot takes document id, page no., dpi, color mode and page filter and
+        renders that page, then emits a signal with QImage. If the unfiltered image
+        raw is not null, it is filtered instead of rendering again. Newly rendered
+        unfiltered image is also emitted when a filter is used.
+        Draft images are marked with "draft" text key, see isDraft() """
+        if worker!=self:
+            return
+        try:
+            if raw.isNull():
+                start = time.perf_counter()
+                img = self.docs[doc_id].renderPage(page_no, dpi, color_mode, draft)
+                if not draft:
+                    self.renderTimed.emit(doc_id, page_no, dpi, time.perf_counter()-start)
+                if filter_name!="none":
+                    img, raw = applyFilter(img, filter_name), img
+                if draft:
+                    img.setText("draft", "1")
+                    raw = QImage()# only full quality images are kept for filtering
+            else:
+                img, raw = applyFilter(raw, filter_name), QImage()
+        except Exception as e:
+            self.jobFailed.emit(repr(e))
+            return
+        self.renderFinished.emit(doc_id, page_no, img, dpi, color_mode, filter_name, raw)
 
+    def compressImage(self, worker, doc_id, page_no, image, dpi, color_mode, filter_name):
+        """ compresses pixel data of a page image removed from render cache """
+        if worker!=self:
+            return
+        try:
+            data = zlib.compress(image.constBits().asstring(image.sizeInBytes()), 1)
+        except Exception as e:
+            self.jobFailed.emit(repr(e))
+            return
+        packed = (data, image.width(), image.height(), image.bytesPerLine(), image.format())
+        self.compressFinished.emit(doc_id, page_no, packed, dpi, color_mode, filter_name)
 
-    def findText(self, worker, text, start, direction):
+    def decompressImage(self, worker, doc_id, page_no, packed, dpi, color_mode, filter_name):
+        """ restores image compressed by compressImage(), and emits it as if rendered """
         if worker!=self:
             return
-        end = 1 if direction==-1 else self.doc.pageCount()
-        pages = [i for i in range(start, end+direction, direction)]
-        for page_no in pages:
-            textareas = self.doc.findText(page_no, text)
-            if textareas != []:
-                self.searchFinished.emit(page_no, textareas)
-                return
-        self.searchFinished.emit(0, [])
+        data, width, height, bytes_per_line, fmt = packed
+        try:
+            img = QImage(zlib.decompress(data), width, height, bytes_per_line, fmt).copy()
+        except Exception as e:
+            self.jobFailed.emit(repr(e))
+            return
+        self.renderFinished.emit(doc_id, page_no, img, dpi, color_mode, filter_name, QImage())
+
+
+    def reclaimMemory(self):
+        """ frees parsed pages and backend resource cache, when user is idle """
+        for doc in self.docs.values():
+            doc.clearCaches()
+            doc.shrinkStore()
+        releaseFreeMemory()
+
+    def findText(self, worker, doc_id, text, start, direction):
+        """ searches upto SEARCH_CHUNK_PAGES pages, so that search of a large
+        document is not a single long job. remaining pages are searched in next job """
+        if worker!=self:
+            return
+        try:
+            end = 1 if direction==-1 else self.docs[doc_id].pageCount()
+            pages = [i for i in range(start, end+direction, direction)]
+            for page_no in pages[:SEARCH_CHUNK_PAGES]:
+                textareas = self.getTextLayer(doc_id, page_no).findText(text)
+                if textareas != []:
+                    self.searchFinished.emit(doc_id, page_no, textareas)
+                    return
+        except Exception as e:
+            self.jobFailed.emit(repr(e))
+            return
+        if len(pages)>SEARCH_CHUNK_PAGES:
+            self.searchContinued.emit(doc_id, text, pages[SEARCH_CHUNK_PAGES], direction)
+        else:
+            self.searchFinished.emit(doc_id, 0, [])
+
+    def runTask(self, worker, task_id, doc_id, kind, page_no, arg):
+        """ runs render, text or search task submitted by plugins """
+        if worker!=self:
+            return
+        result = None
+        try:
+            if kind=="render":
+                result = self.docs[doc_id].renderPage(page_no, *arg)
+            elif kind=="text":
+                result = self.getTextLayer(doc_id, page_no)
+            elif kind=="search":
+                result = self.getTextLayer(doc_id, page_no).findText(arg)
+        except:
+            result = None
+        self.taskFinished.emit(task_id, result)
+
+    def renderThumbnail(self, worker, doc_id, page_no, width, cache_dir):
+        """ renders page at low dpi in RGB16 format. If cache_dir is not empty,
+        thumbnail is loaded from or saved to that directory """
+        if worker!=self:
+            return
+        filename = os.path.join(cache_dir, "%i.png" % page_no) if cache_dir else ""
+        img = QImage(filename) if filename else QImage()
+        try:
+            if img.isNull():
+                page_w, page_h = self.docs[doc_id].pageSize(page_no)
+                img = self.docs[doc_id].renderPage(page_no, max(int(72*width/page_w), 1))
+                img = img.convertToFormat(QImage.Format_RGB16)
+                if filename:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    img.save(filename)
+            else:
+                img = img.convertToFormat(QImage.Format_RGB16)
+        except Exception as e:
+            self.jobFailed.emit(repr(e))
+            return
+        self.thumbnailFinished.emit(doc_id, page_no, img)
+
+    def loadFingerprints(self, worker, doc_id, filename, password, backend_name, data):
+        """ opens the document separately and emits content hash of each page,
+        along with file data from which hashes are computed. If data is None, file
+        is read. emits empty list if file can not be read (e.g it is being written) """
+        if worker!=self:
+            return
+        fingerprints = []
+        try:
+            if data is None:
+                data = readFile(filename)
+            doc = PdfDocument(filename, backend_name, data)
+            if doc.isValid() and (not doc.isLocked() or doc.unlock(password)):
+                fingerprints = [doc.pageFingerprint(i) for i in range(1, doc.pageCount()+1)]
+                data = doc.data
+        except:
+            fingerprints = []
+        self.fingerprintsFinished.emit(doc_id, fingerprints, data)
 
 
 class Manager(QObject):
+    """ Distributes render, search and text jobs of all opened documents among
+    the workers. Jobs of the current document are given priority. """
     # signals
-    renderRequested = pyqtSignal(Worker, int, int)# worker, page_no, dpi
-    searchRequested = pyqtSignal(Worker, str, int, int)#worker, text, start, direction
+    renderRequested = pyqtSignal(Worker, int, int, int, str, str, QImage, bool)# worker, doc_id, page_no, dpi, color_mode, filter_name, raw, draft
+    searchRequested = pyqtSignal(Worker, int, str, int, int)#worker, doc_id, text, start, direction
+    textLayerRequested = pyqtSignal(Worker, int, int)# worker, doc_id, page_no
+    fingerprintsRequested = pyqtSignal(Worker, int, str, str, str, object)# worker, doc_id, filename, password, backend, data
+    thumbnailRequested = pyqtSignal(Worker, int, int, int, str)# worker, doc_id, page_no, width, cache_dir
+    taskRequested = pyqtSignal(Worker, int, int, str, int, object)# worker, task_id, doc_id, kind, page_no, arg
+    compressRequested = pyqtSignal(Worker, int, int, QImage, int, str, str)# worker, doc_id, page_no, image, dpi, color_mode, filter_name
+    decompressRequested = pyqtSignal(Worker, int, int, object, int, str, str)# worker, doc_id, page_no, packed image, dpi, color_mode, filter_name
+    reclaimRequested = pyqtSignal()
+    documentsRequested = pyqtSignal(Worker, list)# worker, [(doc_id, filename, password, backend, data)]
 
     def __init__(self, parent):
         QObject.__init__(self, parent)
         self.curr_page_no = -1
         self.threads = []
-        self.workers = {} # {worker:state} dictionary, state = free|busy
-        self.render_cache = {} #{page_no:image} dictionary
-        self.being_rendered = [] # sent to worker for rendering
+        # {worker:state} dictionary, state is "free" or (kind, doc_id, key, start_time)
+        # of running job, where key is page_no or task_id
+        self.workers = {}
+        self.render_cache = {} #{page_no:QImage} dictionary of current document
+        # max memory used by cached images of all documents in bytes
+        self.cache_size_limit = 64*1024*1024
+        # max memory used by compressed images of all documents
+        self.warm_cache_limit = 64*1024*1024
+        # images waiting to be compressed, about a quarter of cache_size_limit
+        self.compress_jobs = [] # [doc_id, page_no, image, dpi, color_mode, filter_name] lists
+        self.color_mode = "color" # color | gray | auto
+        self.filter_name = "none" # none or a name in image_filters.filters
+        self.being_rendered = [] # (doc_id,page_no) sent to worker for rendering
         self.search_text = None
-        # Create separate thread and move worker to it
+        self.search_no = 0 # increased for each new search, older search is not continued
+        self.prefetch_count = 1 # no. of next pages rendered in advance
+        self.speculative_pages = [] # (doc_id,page_no) of link targets under mouse, most recent last
+        # while scrolling fast, pages of current document are rendered in low quality
+        self.draft_mode = False
+        # after memory is reclaimed, set until user input. see set_idle()
+        self.idle = False
+        self.text_cache = TextLayerCache()
+        self.text_requests = {} # {page_no : [callbacks]} dictionary
+        self.being_extracted = [] # (doc_id,page_no) whose text layer is being extracted
+        self.fingerprint_jobs = [] # [doc_id, filename, password, backend, data] lists
+        # thumbnails are rendered only by idle workers
+        self.thumbnail_jobs = [] # page_nos of current document, visible thumbnails first
+        self.thumbnail_args = None # (doc_id, width, cache_dir)
+        self.being_thumbnailed = [] # (doc_id,page_no) sent to worker
+        # tasks of plugin jobs
+        self.plugin_tasks = [] # [job, doc_id, kind, page_no, arg] lists
+        self.running_tasks = {} # {task_id : task} dictionary
+        self.last_task_id = 0
+        # jobs running longer than this many seconds are failed, and the worker
+        # is replaced. fingerprints of whole document get 4x time, and a page which
+        # timed out is rendered again with 4x time before it is failed
+        self.job_timeout = 30
+        self.failures = {} # {kind : count} of failed and timed out jobs
+        self.recycled_count = 0 # no. of stuck workers replaced
+        self.stuck_threads = [] # (thread, worker) left to finish stuck job
         self.thread_count = 3
         for i in range(self.thread_count):
-            thread = QThread(self)
-            self.threads.append(thread)
-            worker = Worker()
-            worker.moveToThread(thread) # must be moved before connecting signals
-            App.window.loadFileRequested.connect(worker.loadDocument)
-            self.renderRequested.connect(worker.render)
-            worker.renderFinished.connect(self.onRenderFinished)
-            self.searchRequested.connect(worker.findText)
-            worker.searchFinished.connect(self.onSearchFinished)
-            thread.start()
-            # add to workers dict
-            self.workers[worker] = "free"
+            self.add_worker()
+        self.watchdog = QTimer(self)
+        self.watchdog.setInterval(1000)
+        self.watchdog.timeout.connect(self.check_workers)
+        self.watchdog.start()
+
+    def worker_connections(self, worker):
+        """ returns (signal, slot) pairs connecting the worker """
+        return [(App.window.loadFileRequested, worker.loadDocument),
+            (App.window.closeFileRequested, worker.closeDocument),
+            (self.renderRequested, worker.render),
+            (worker.renderFinished, self.onRenderFinished),
+            (worker.renderTimed, self.onRenderTimed),
+            (self.searchRequested, worker.findText),
+            (worker.searchFinished, self.onSearchFinished),
+            (worker.searchContinued, self.onSearchContinued),
+            (self.textLayerRequested, worker.loadTextLayer),
+            (worker.textLayerFinished, self.onTextLayerFinished),
+            (self.fingerprintsRequested, worker.loadFingerprints),
+            (worker.fingerprintsFinished, self.onFingerprintsFinished),
+            (self.thumbnailRequested, worker.renderThumbnail),
+            (worker.thumbnailFinished, self.onThumbnailFinished),
+            (self.taskRequested, worker.runTask),
+            (worker.taskFinished, self.onTaskFinished),
+            (self.compressRequested, worker.compressImage),
+            (worker.compressFinished, self.onCompressFinished),
+            (self.decompressRequested, worker.decompressImage),
+            (worker.jobFailed, self.onJobFailed),
+            (self.reclaimRequested, worker.reclaimMemory),
+            (self.documentsRequested, worker.loadDocuments)]
+
+    def add_worker(self):
+        """ creates a worker in separate thread, with opened documents loaded """
+        thread = QThread(self)
+        self.threads.append(thread)
+        worker = Worker(self.text_cache)
+        worker.moveToThread(thread) # must be moved before connecting signals
+        for signal, slot in self.worker_connections(worker):
+            signal.connect(slot)
+        thread.start()
+        # documents are loaded in worker thread, before any job sent to it
+        if App.documents:
+            self.documentsRequested.emit(worker, [(document.id, document.filename, document.passwd,
+                                document.doc.name, document.doc.data) for document in App.documents])
+        self.workers[worker] = "free"
+
+    def reclaim_memory(self):
+        """ frees memory while user is idle. rendered images are trimmed to a
+        quarter of cache limits, keeping the current pages, and caches of text,
+        parsed pages and backend are cleared. removed pages are not compressed
+        or rendered again until user input. returns False if workers are busy """
+        if any(state!="free" for state in self.workers.values()):
+            return False
+        self.idle = True
+        self.trim_cache(size_limit=self.cache_size_limit//4, keep=self.view_pages(), compress=False)
+        self.compress_jobs.clear()
+        self.trim_warm_cache(size_limit=self.warm_cache_limit//4)
+        self.text_cache.clear()
+        for document in App.documents:
+            document.doc.clearCaches()
+        QPixmapCache.clear()
+        # workers free memory after their documents, as backend store is shared
+        self.reclaimRequested.emit()
+        return True
+
+    def set_idle(self, idle):
+        """ while idle, only the viewed pages of current document are rendered """
+        if idle==self.idle:
+            return
+        self.idle = idle
+        if not idle:
+            self.run_free_workers()
+
+    def start_job(self, worker, kind, doc_id, key=None):
+        self.workers[worker] = (kind, doc_id, key, time.monotonic())
+
+    def finish_job(self):
+        """ marks the worker which sent the result free. returns False if the
+        result is of a recycled worker, which must be ignored """
+        worker = self.sender()
+        if worker not in self.workers:
+            return False
+        self.workers[worker] = "free"
+        return True
+
+    def check_workers(self):
+        """ fails the jobs which are running too long, and replaces their workers """
+        now = time.monotonic()
+        for worker, state in list(self.workers.items()):
+            if state=="free":
+                continue
+            kind, doc_id, key, start_time = state
+            documents = [doc for doc in App.documents if doc.id==doc_id]
+            timeout = self.job_timeout*4 if kind=="fingerprints" else self.job_timeout
+            if kind=="render" and documents:
+                timeout = documents[0].timed_out_pages.get(key, timeout)
+            if now-start_time <= timeout:
+                continue
+            self.recycle_worker(worker)
+            # page may be just slow, so it is rendered again once with longer time limit
+            if kind=="render" and documents and key not in documents[0].timed_out_pages:
+                documents[0].timed_out_pages[key] = self.job_timeout*4
+                self.being_rendered.remove((doc_id,key))
+                self.run_free_workers()
+            else:
+                self.job_failed(kind, doc_id, key, "timed out after %i sec" % timeout)
+
+    def recycle_worker(self, worker):
+        """ replaces a stuck worker. its thread quits when the job returns """
+        for signal, slot in self.worker_connections(worker):
+            signal.disconnect(slot)
+        del self.workers[worker]
+        thread = worker.thread()
+        self.threads.remove(thread)
+        thread.quit()
+        self.stuck_threads.append((thread, worker))# worker must not be deleted while running
+        self.recycled_count += 1
+        self.add_worker()
+
+    def onJobFailed(self, error):
+        worker = self.sender()
+        state = self.workers.get(worker)
+        if not self.finish_job():
+            return
+        self.job_failed(*state[:3], error)
+
+    def job_failed(self, kind, doc_id, key, error):
+        """ cleans up after a failed job, so that it gets a result """
+        documents = [doc for doc in App.documents if doc.id==doc_id]
+        # jobs of closed or reloaded documents fail when worker has closed the document
+        if documents or kind=="task":
+            self.failures[kind] = self.failures.get(kind, 0) + 1
+            debug("Job failed :", kind, doc_id, key, error)
+        if kind=="render":
+            self.being_rendered.remove((doc_id,key))
+            if documents:# failed page is not rendered again until reloaded
+                documents[0].failed_pages[key] = error
+                if documents[0] is App.document:
+                    App.window.onPageRenderFailed(key, error)
+        elif kind=="text":
+            self.being_extracted.remove((doc_id,key))
+            if App.document and doc_id==App.document.id:
+                for callback in self.text_requests.pop(key, []):
+                    callback(TextLayer([], [], []))
+        elif kind=="search":
+            if App.document and doc_id==App.document.id and key==self.search_no:
+                App.window.onSearchFinished(0, [])
+        elif kind=="thumbnail":
+            self.being_thumbnailed.remove((doc_id,key))
+        elif kind=="task":
+            job, doc_id, task_kind, page_no, arg = self.running_tasks.pop(key)
+            job.taskFinished(page_no, None)
+        elif kind=="fingerprints":
+            App.window.onFingerprintsFinished(doc_id, [], None)
+        self.run_free_workers()
 
     def clear_cache(self):
         self.render_cache.clear()
+        # images of other filters are of same size as this cache
+        if App.document and self.render_cache is App.document.render_cache:
+            App.document.filter_caches.clear()
+            App.document.warm_cache.clear()
+
+    def clear_text_cache(self):
+        self.text_cache.clear()
+        self.text_requests.clear()
+
+    def request_text_layer(self, page_no, callback):
+        """ callback is called with TextLayer of the page, immediately if it is
+        cached, otherwise after a worker extracts it """
+        layer = self.text_cache.get((App.document.id, page_no))
+        if layer:
+            callback(layer)
+            return
+        self.text_requests.setdefault(page_no, []).append(callback)
+        self.run_free_workers()
+
+    def request_fingerprints(self, doc_id, filename, password, backend_name, data=None):
+        """ fingerprints are computed after pages of current document are rendered.
+        file is read if data is None """
+        self.fingerprint_jobs.append([doc_id, filename, password, backend_name, data])
+        self.run_free_workers()
+
+    def request_thumbnails(self, doc_id, page_nos, width, cache_dir):
+        """ replaces previously requested thumbnails """
+        self.thumbnail_args = (doc_id, width, cache_dir)
+        self.thumbnail_jobs = [page_no for page_no in page_nos if not (doc_id,page_no) in self.being_thumbnailed]
+        self.run_free_workers()
+
+    def submit_job(self, job, kind, page_nos, arg):
+        """ split plugin job into tasks of each page of current document """
+        for page_no in page_nos:
+            if not App.document:
+                QTimer.singleShot(0, partial(job.taskFinished, page_no, None))
+            elif (kind=="render" and self.is_view_render(page_no, arg) and page_no in self.render_cache
+                    and not isDraft(self.render_cache[page_no])):
+                # job is returned before result is given
+                QTimer.singleShot(0, partial(job.taskFinished, page_no, self.render_cache[page_no]))
+            else:
+                self.plugin_tasks.append([job, App.document.id, kind, page_no, arg])
+        self.run_free_workers()
+
+    def cancel_job(self, job):
+        self.plugin_tasks = [task for task in self.plugin_tasks if task[0] is not job]
+
+    def is_view_render(self, page_no, arg):
+        """ whether a render task is same as rendering the page for viewing """
+        dpi, color_mode = arg
+        return (dpi==App.page_dpis.get(page_no) and color_mode==self.color_mode
+                and self.filter_name=="none")
+
+    def set_draft_mode(self, draft):
+        """ draft pages are rendered again in full quality when draft mode ends """
+        if draft==self.draft_mode:
+            return
+        self.draft_mode = draft
+        if not draft:
+            self.run_free_workers()
+
+    def prefetch_page(self, page_no):
+        """ renders a page of current document which is likely to be shown soon,
+        e.g target of a link under mouse, after visible pages are rendered """
+        key = (App.document.id, page_no)
+        if page_no in self.render_cache or key in self.being_rendered or key in self.speculative_pages:
+            return
+        self.speculative_pages = self.speculative_pages[-2:] + [key]
+        self.run_free_workers()
+
+    def add_render_time(self, document, page_no, dpi, seconds):
+        """ render cost is kept as time to render at 72 dpi, as time is
+        nearly proportional to number of pixels """
+        cost = seconds*(72/dpi)**2
+        old_cost = document.render_costs.get(page_no)
+        document.render_costs[page_no] = cost if old_cost is None else (old_cost+cost)/2
+
+    def render_time(self, document, page_no, dpi):
+        """ returns measured render time of page at dpi, or None if not known """
+        cost = document.render_costs.get(page_no)
+        return None if cost is None else cost*(dpi/72)**2
+
+    def estimate_render_time(self, document, page_nos, dpi):
+        """ returns total render time of pages. median cost of measured pages
+        is used for pages not rendered before """
+        costs = sorted(document.render_costs.values())
+        default = costs[len(costs)//2] if costs else 0
+        return sum(document.render_costs.get(page_no, default) for page_no in page_nos)*(dpi/72)**2
+
+    def view_pages(self):
+        """ page_nos of current document which are rendered for viewing """
+        return range(self.curr_page_no-1, self.curr_page_no+self.prefetch_count+1)
+
+    def image_size(self, document, page_no, dpi):
+        """ estimated memory used by rendered image of page, with unfiltered copy """
+        page_w, page_h = document.page_sizes[page_no-1]
+        size = math.ceil(page_w*dpi/72+1)*math.ceil(page_h*dpi/72+1)*4
+        return size if self.filter_name=="none" else 2*size
+
+    def is_slow_page(self, document, page_no, dpi):
+        return (self.render_time(document, page_no, dpi) or 0) > SLOW_RENDER_TIME
 
     def set_current_page_no(self, page_no):
         self.curr_page_no = page_no
         self.run_free_workers()
 
     def find_text(self, text, start_page, direction):
-        self.search_text = [text, start_page, direction]
+        self.search_no += 1
+        self.search_text = [App.document.id, text, start_page, direction]
         self.run_free_workers()
 
     def run_free_workers(self):
+        if not App.document:
+            return
+        doc_id = App.document.id
         # get which pages to render
         to_render = []
-        for x in (0, -1, 1):
+        for x in [0] + list(range(1, self.prefetch_count+1)) + [-1]:
             page_no = self.curr_page_no + x
-            if page_no>0 and page_no<=App.window.pages_count:
-                if not page_no in self.render_cache and not page_no in self.being_rendered:
-                    to_render.append(page_no)
+            # page_dpis are not calculated until pages are added
+            if page_no>0 and page_no<=App.window.pages_count and page_no in App.page_dpis:
+                image = self.render_cache.get(page_no)
+                if ((not image or (isDraft(image) and not self.draft_mode)) and
+                        not (doc_id,page_no) in self.being_rendered):
+                    to_render.append((App.document, page_no, App.page_dpis[page_no]))
+        # pages known to be slow are started earlier than other pages, only if they
+        # fit in cache along with viewed pages, otherwise they would be removed
+        # before shown, and rendered again and again
+        budget = self.cache_size_limit - sum(self.image_size(App.document, page_no, App.page_dpis[page_no])
+                                for page_no in self.view_pages() if page_no in App.page_dpis)
+        for page_no in range(self.curr_page_no+self.prefetch_count+1, self.curr_page_no+self.prefetch_count+4):
+            if (page_no in App.page_dpis and not page_no in self.render_cache and
+                    not (doc_id,page_no) in self.being_rendered and
+                    self.is_slow_page(App.document, page_no, App.page_dpis[page_no])):
+                budget -= self.image_size(App.document, page_no, App.page_dpis[page_no])
+                if budget<0:
+                    break
+                to_render.append((App.document, page_no, App.page_dpis[page_no]))
+        # current pages of documents in other tabs are rendered using
+        # one worker at a time, so that current document is not slowed down
+        if not [1 for id_,page_no in self.being_rendered if id_!=doc_id]:
+            for document in App.documents:
+                page_no = document.curr_page_no
+                if (document.id==doc_id or page_no in document.render_cache or
+                        not page_no in document.page_dpis or page_no in document.failed_pages):
+                    continue
+                to_render.append((document, page_no, document.page_dpis[page_no]))
+                break
+        # link targets are rendered last, most recently hovered first
+        self.speculative_pages = [(id_,page_no) for id_,page_no in self.speculative_pages
+                        if id_==doc_id and page_no in App.page_dpis and not page_no in self.render_cache]
+        for id_,page_no in reversed(self.speculative_pages):
+            if not (id_,page_no) in self.being_rendered and not page_no in [x[1] for x in to_render]:
+                to_render.append((App.document, page_no, App.page_dpis[page_no]))
+
+        to_render = [job for job in to_render if job[1] not in job[0].failed_pages]
+        # pages removed when memory was reclaimed are not rendered until user input
+        if self.idle:
+            to_render = [job for job in to_render if job[0] is App.document and job[1] in self.view_pages()]
+
+        to_extract = [page_no for page_no in self.text_requests if not (doc_id,page_no) in self.being_extracted]
+        # tasks of closed documents are finished without result
+        doc_ids = [document.id for document in App.documents]
+        for task in [task for task in self.plugin_tasks if task[1] not in doc_ids]:
+            self.plugin_tasks.remove(task)
+            task[0].taskFinished(task[3], None)
 
         free_workers = [worker for worker,state in self.workers.items() if state=="free"]
         for worker in free_workers:
             if self.search_text:
-                self.workers[worker] = "busy"
+                self.start_job(worker, "search", self.search_text[0], self.search_no)
                 self.searchRequested.emit(worker, *self.search_text)
                 self.search_text = None
+            elif to_extract:
+                page_no = to_extract.pop(0)
+                self.start_job(worker, "text", doc_id, page_no)
+                self.textLayerRequested.emit(worker, doc_id, page_no)
+                self.being_extracted.append((doc_id,page_no))
             elif to_render:
-                self.workers[worker] = "busy"
-                page_no = to_render.pop(0)
-                self.renderRequested.emit(worker, page_no, App.page_dpis[page_no])
-                self.being_rendered.append(page_no)
-
-    def onRenderFinished(self, page_no, image, dpi):
-        worker = self.sender()
-        self.workers[worker] = "free"
-        self.being_rendered.remove(page_no)
-        # if page resized while rendering, rendered image is of no use
-        if dpi!=App.page_dpis[page_no]:
+                document, page_no, dpi = to_render.pop(0)
+                self.start_job(worker, "render", document.id, page_no)
+                warm = document.warm_cache.get(page_no)
+                if warm and warm[1:]==(dpi, self.color_mode, self.filter_name):
+                    del document.warm_cache[page_no]
+                    self.decompressRequested.emit(worker, document.id, page_no, warm[0], dpi,
+                                    self.color_mode, self.filter_name)
+                else:
+                    # slow current page is shown as draft until it is rendered fully
+                    draft = document is App.document and (self.draft_mode or (page_no==self.curr_page_no
+                            and not page_no in self.render_cache and self.is_slow_page(document, page_no, dpi)))
+                    self.renderRequested.emit(worker, document.id, page_no, dpi, self.color_mode,
+                                    self.filter_name, self.unfiltered_image(document, page_no), draft)
+                self.being_rendered.append((document.id,page_no))
+            elif self.compress_jobs:
+                job = self.compress_jobs.pop(0)
+                self.start_job(worker, "compress", job[0], job[1])
+                self.compressRequested.emit(worker, *job)
+            elif self.plugin_tasks:
+                self.last_task_id += 1
+                self.start_job(worker, "task", self.plugin_tasks[0][1], self.last_task_id)
+                task = self.plugin_tasks.pop(0)
+                self.running_tasks[self.last_task_id] = task
+                self.taskRequested.emit(worker, self.last_task_id, *task[1:])
+            elif self.fingerprint_jobs:
+                job = self.fingerprint_jobs.pop(0)
+                self.start_job(worker, "fingerprints", job[0])
+                self.fingerprintsRequested.emit(worker, *job)
+            elif self.thumbnail_jobs and self.thumbnail_args[0]==doc_id:
+                page_no = self.thumbnail_jobs.pop(0)
+                self.start_job(worker, "thumbnail", doc_id, page_no)
+                id_, width, cache_dir = self.thumbnail_args
+                self.thumbnailRequested.emit(worker, id_, page_no, width, cache_dir)
+                self.being_thumbnailed.append((id_,page_no))
+
+    def set_color_mode(self, color_mode):
+        self.color_mode = color_mode
+        for document in App.documents:
+            document.render_cache.clear()
+            document.filter_caches.clear()
+            document.warm_cache.clear()
+        self.compress_jobs.clear()
+        self.clear_cache()
+
+    def set_filter(self, filter_name):
+        """ images of previous filter are kept, so that they can be shown
+        again without rendering """
+        old_filter, self.filter_name = self.filter_name, filter_name
+        for document in App.documents:
+            document.filter_caches[old_filter] = document.render_cache
+            document.render_cache = document.filter_caches.pop(filter_name, {})
+            document.warm_cache.clear()
+        self.compress_jobs.clear()
+        if App.document and not App.window.presentation_mode:
+            self.render_cache = App.document.render_cache
+        else:
+            self.render_cache.clear()
+
+    def unfiltered_image(self, document, page_no):
+        """ returns cached unfiltered image of page, or null image if not available """
+        # in presentation mode, unfiltered images of normal mode are of different size
+        if self.filter_name=="none" or (document is App.document and self.render_cache is not document.render_cache):
+            return QImage()
+        return document.filter_caches.get("none", {}).get(page_no, QImage())
+
+    def trim_cache(self, extra_size=0, size_limit=None, keep=(), compress=True):
+        """ remove old rendered pages until images of all documents fit in
+        memory limit. grayscale pages use less memory, so more pages can be kept.
+        pages of other tabs are removed first, and three recently rendered pages
+        of current document are always kept, along with page_nos in keep. Removed
+        pages which are shown in normal mode are compressed to warm cache, if
+        compress is True. """
+        if size_limit is None:
+            size_limit = self.cache_size_limit
+        # images of other filters are not shown, so these are removed first
+        caches = [(doc, cache, False) for doc in App.documents for cache in doc.filter_caches.values()]
+        # render_cache of current document is not in the list in normal mode
+        caches += [(doc, doc.render_cache, True) for doc in App.documents if doc.render_cache is not self.render_cache]
+        # document is None in presentation mode, as its images are not compressed
+        document = App.document if App.document and self.render_cache is App.document.render_cache else None
+        caches.append((document, self.render_cache, True))
+        cache_size = extra_size
+        for document, cache, shown in caches:
+            cache_size += sum(img.sizeInBytes() for img in cache.values())
+        for document, cache, shown in caches:
+            min_count = 3 if cache is self.render_cache else 0
+            removable = [page_no for page_no in cache if not (cache is self.render_cache and page_no in keep)]
+            while cache_size>size_limit and len(cache)>min_count and removable:
+                cleared_page_no = removable.pop(0)
+                image = cache.pop(cleared_page_no)
+                cache_size -= image.sizeInBytes()
+                if shown:
+                    App.window.clearPageImage(cleared_page_no, document)
+                if (compress and document and cache is document.render_cache and
+                        self.warm_cache_limit>0 and not isDraft(image)):
+                    self.compress_jobs.append([document.id, cleared_page_no, image,
+                            document.page_dpis[cleared_page_no], self.color_mode, self.filter_name])
+                debug("Clear Page :", cleared_page_no)
+        # compress jobs wait while pages are rendered, so while scrolling the queue
+        # would grow without limit. oldest images are dropped instead of compressed
+        queue_size = sum(job[2].sizeInBytes() for job in self.compress_jobs)
+        while queue_size>self.cache_size_limit//4 and len(self.compress_jobs)>1:
+            queue_size -= self.compress_jobs.pop(0)[2].sizeInBytes()
+
+    def trim_warm_cache(self, extra_size=0, size_limit=None):
+        """ remove least recently compressed pages, of other tabs first """
+        if size_limit is None:
+            size_limit = self.warm_cache_limit
+        cache_size = extra_size
+        for document in App.documents:
+            cache_size += sum(len(warm[0][0]) for warm in document.warm_cache.values())
+        for document in sorted(App.documents, key=lambda doc: doc is App.document):
+            while cache_size>size_limit and document.warm_cache:
+                page_no, warm = document.warm_cache.popitem(last=False)
+                cache_size -= len(warm[0][0])
+
+    def onRenderFinished(self, doc_id, page_no, image, dpi, color_mode, filter_name, raw):
+        if not self.finish_job():
+            return
+        self.being_rendered.remove((doc_id,page_no))
+        documents = [doc for doc in App.documents if doc.id==doc_id]
+        # document may be closed while rendering
+        if not documents:
+            self.run_free_workers()
+            return
+        document = documents[0]
+        if document is App.document:
+            render_cache, page_dpis = self.render_cache, App.page_dpis
+        else:
+            render_cache, page_dpis = document.render_cache, document.page_dpis
+        # if page resized, color mode or filter changed while rendering, rendered image is of no use
+        if dpi!=page_dpis.get(page_no) or color_mode!=self.color_mode or filter_name!=self.filter_name:
             self.run_free_workers()
             return
         # remove old rendered pages
-        if len(self.render_cache)>10:
-            cleared_page_no = list(self.render_cache.keys())[0]
-            del self.render_cache[cleared_page_no]
-            App.window.clearPageImage(cleared_page_no)
-            debug("Clear Page :", cleared_page_no)
+        # pages being viewed are kept, so that lookahead pages can not remove them
+        keep = self.view_pages() if document is App.document else ()
+        self.trim_cache(image.sizeInBytes() + raw.sizeInBytes(), keep=keep)
+        # unfiltered image is kept, so that filter can be changed without rendering again
+        if not raw.isNull() and render_cache is document.render_cache:
+            document.filter_caches.setdefault("none", {})[page_no] = raw
         # set rendered image
-        self.render_cache[page_no] = QPixmap.fromImage(image)
-        App.window.onNewPageRendered(page_no, self.render_cache[page_no])
+        # image is already in screen format (converted in worker thread),
+        # so it is drawn without any conversion
+        render_cache[page_no] = image
+        if document is App.document:
+            App.window.onNewPageRendered(page_no, image)
         self.run_free_workers()
 
 
-    def onSearchFinished(self, page_nos, areas):
-        worker = self.sender()
-        self.workers[worker] = "free"
-        App.window.onSearchFinished(page_nos, areas)
+    def onRenderTimed(self, doc_id, page_no, dpi, seconds):
+        for document in App.documents:
+            if document.id==doc_id:
+                self.add_render_time(document, page_no, dpi, seconds)
+
+    def onTextLayerFinished(self, doc_id, page_no, layer):
+        if not self.finish_job():
+            return
+        self.being_extracted.remove((doc_id,page_no))
+        # text layer may be of another document
+        if App.document and doc_id==App.document.id:
+            for callback in self.text_requests.pop(page_no, []):
+                callback(layer)
+        self.run_free_workers()
+
+    def onSearchFinished(self, doc_id, page_no, areas):
+        state = self.workers.get(self.sender())
+        if not self.finish_job():
+            return
+        # result of an old search is not shown
+        if App.document and doc_id==App.document.id and state[2]==self.search_no:
+            App.window.onSearchFinished(page_no, areas)
+        self.run_free_workers()
+
+    def onSearchContinued(self, doc_id, text, page_no, direction):
+        state = self.workers.get(self.sender())
+        if not self.finish_job():
+            return
+        # search is not continued if a new search is requested or document closed
+        if (App.document and doc_id==App.document.id and state[2]==self.search_no
+                and self.search_text is None):
+            self.search_text = [doc_id, text, page_no, direction]
+        self.run_free_workers()
+
+    def onFingerprintsFinished(self, doc_id, fingerprints, data):
+        if not self.finish_job():
+            return
+        App.window.onFingerprintsFinished(doc_id, fingerprints, data)
+        self.run_free_workers()
+
+    def onTaskFinished(self, task_id, result):
+        if not self.finish_job():
+            return
+        job, doc_id, kind, page_no, arg = self.running_tasks.pop(task_id)
+        # page rendered for plugin can be used for viewing
+        if (kind=="render" and result and App.document and doc_id==App.document.id and
+                self.is_view_render(page_no, arg) and
+                (page_no not in self.render_cache or isDraft(self.render_cache[page_no]))):
+            self.trim_cache(result.sizeInBytes(), keep=self.view_pages())
+            self.render_cache[page_no] = result
+            App.window.onNewPageRendered(page_no, result)
+        job.taskFinished(page_no, result)
+        self.run_free_workers()
+
+    def onCompressFinished(self, doc_id, page_no, packed, dpi, color_mode, filter_name):
+        if not self.finish_job():
+            return
+        documents = [doc for doc in App.documents if doc.id==doc_id]
+        # page may be rendered again or resized while compressing
+        if (documents and page_no not in documents[0].render_cache and
+                dpi==documents[0].page_dpis.get(page_no) and
+                color_mode==self.color_mode and filter_name==self.filter_name):
+            self.trim_warm_cache(len(packed[0]))
+            documents[0].warm_cache[page_no] = (packed, dpi, color_mode, filter_name)
+        self.run_free_workers()
+
+    def onThumbnailFinished(self, doc_id, page_no, image):
+        if not self.finish_job():
+            return
+        self.being_thumbnailed.remove((doc_id,page_no))
+        App.window.onThumbnailRendered(doc_id, page_no, image)
+        self.run_free_workers()
 
     def close_threads(self):
         """ Close running threads """
+        self.watchdog.stop()
         for thread in self.threads:
             loop = QEventLoop()
             thread.finished.connect(loop.quit)
             thread.quit()
             loop.exec()
+        for thread, worker in self.stuck_threads:
+            if not thread.wait(500):
+                thread.terminate()
+                thread.wait()
 
 
 
 class Window(QMainWindow, Ui_window):
-    loadFileRequested = pyqtSignal(str, str)
+    loadFileRequested = pyqtSignal(int, str, str, str, object)# doc_id, filename, password, backend, data
+    closeFileRequested = pyqtSignal(int)# doc_id
     fileOpened = pyqtSignal(str) # for plugin manager
+    pageJumped = pyqtSignal(int, float) # page_no, top
+    textSearched = pyqtSignal(str, int) # text, direction
 
     def __init__(self, parent=None):
         QMainWindow.__init__(self, parent)
@@ -204,10 +1011,26 @@ class Window(QMainWindow, Ui_window):
         self.findTextEdit.setFocusPolicy(Qt.StrongFocus)
         self.treeView.setAlternatingRowColors(True)
         self.treeView.clicked.connect(self.onOutlineClick)
+        self.treeView.setMouseTracking(True)
+        self.treeView.entered.connect(self.onOutlineHover)
+        # one tab for each opened document
+        self.tabBar = QTabBar(self)
+        self.tabBar.setDocumentMode(True)
+        self.tabBar.setTabsClosable(True)
+        self.tabBar.setExpanding(False)
+        self.tabBar.setAutoHide(True)
+        self.tabBar.currentChanged.connect(self.onTabChange)
+        self.tabBar.tabCloseRequested.connect(self.onTabCloseRequest)
+        self.centralLayout.insertWidget(0, self.tabBar)
         # resizing pages requires some time to take effect
         self.resize_page_timer = QTimer(self)
         self.resize_page_timer.setSingleShot(True)
         self.resize_page_timer.timeout.connect(self.onWindowResize)
+        # pages are rendered in draft quality until scrolling stops
+        self.last_scroll = None # (scrollbar pos, time)
+        self.scroll_stop_timer = QTimer(self)
+        self.scroll_stop_timer.setSingleShot(True)
+        self.scroll_stop_timer.timeout.connect(self.onScrollStop)
         # Add shortcut actions
         self.gotoPageAction = QAction(QIcon(":/icons/goto.png"), "GoTo Page", self)
         self.gotoPageAction.triggered.connect(self.gotoPage)
@@ -217,6 +1040,77 @@ class Window(QMainWindow, Ui_window):
         self.findTextAction = QAction(QIcon(":/icons/search.png"), "Find Text", self)
         self.findTextAction.setShortcut('Ctrl+F')
         self.findTextAction.triggered.connect(self.dockSearch.show)
+        self.backendMenu = self.viewMenu.addMenu("PDF Backend")
+        # backends are imported only when this menu is shown
+        self.backendMenu.aboutToShow.connect(self.updateBackendMenu)
+        self.colorModeMenu = self.viewMenu.addMenu("Render Colors")
+        colorModeGroup = QActionGroup(self)
+        for title, color_mode in (("Color", "color"), ("Grayscale", "gray"),
+                                    ("Auto Detect Grayscale Pages", "auto")):
+            action = self.colorModeMenu.addAction(title, self.setColorMode)
+            action.setCheckable(True)
+            action.color_mode = color_mode
+            colorModeGroup.addAction(action)
+        self.pageFilterMenu = self.viewMenu.addMenu("Page Filter")
+        pageFilterGroup = QActionGroup(self)
+        for filter_name, title in [("none", "None")] + [(name, filters[name][0]) for name in filters]:
+            action = self.pageFilterMenu.addAction(title, self.setPageFilter)
+            action.setCheckable(True)
+            action.filter_name = filter_name
+            pageFilterGroup.addAction(action)
+        if not filtersAvailable():# filters require numpy
+            self.pageFilterMenu.setEnabled(False)
+        # thumbnails dock, tabified with outlines dock
+        self.thumbnailDock = QDockWidget("    Thumbnails :", self)
+        self.thumbnailDock.setObjectName("thumbnailDock")
+        self.thumbnailDock.setFeatures(QDockWidget.DockWidgetClosable|QDockWidget.DockWidgetMovable)
+        self.thumbnailDock.setAllowedAreas(Qt.LeftDockWidgetArea|Qt.RightDockWidgetArea)
+        self.thumbnailView = QListWidget(self.thumbnailDock)
+        self.thumbnailView.setViewMode(QListView.IconMode)
+        self.thumbnailView.setFlow(QListView.TopToBottom)
+        self.thumbnailView.setWrapping(False)
+        self.thumbnailView.setMovement(QListView.Static)
+        self.thumbnailView.setUniformItemSizes(True)
+        self.thumbnailView.setSpacing(4)
+        self.thumbnailView.setIconSize(QSize(THUMBNAIL_WIDTH, int(THUMBNAIL_WIDTH*1.414)))
+        self.thumbnailView.itemClicked.connect(self.onThumbnailClick)
+        self.thumbnailView.verticalScrollBar().valueChanged.connect(self.requestThumbnails)
+        self.thumbnailDock.setWidget(self.thumbnailView)
+        self.addDockWidget(Qt.LeftDockWidgetArea, self.thumbnailDock)
+        self.tabifyDockWidget(self.dockWidget, self.thumbnailDock)
+        self.thumbnailDock.hide()
+        self.thumbnailDock.visibilityChanged.connect(self.updateThumbnails)
+        self.thumbnail_doc = None # document whose thumbnails are in thumbnailView
+        thumbnailAction = self.thumbnailDock.toggleViewAction()
+        thumbnailAction.setText("Page Thumbnails")
+        self.viewMenu.addAction(thumbnailAction)
+        self.thumbnailDiskCacheAction = self.viewMenu.addAction("Save Thumbnails on Disk")
+        self.thumbnailDiskCacheAction.setCheckable(True)
+        self.thumbnailDiskCacheAction.triggered.connect(self.toggleThumbnailDiskCache)
+        self.searchLibraryAction = QAction("Search Library", self)
+        self.searchLibraryAction.setShortcut("Ctrl+Shift+F")
+        self.searchLibraryAction.triggered.connect(self.searchLibrary)
+        self.fileMenu.insertAction(self.quitAction, self.searchLibraryAction)
+        self.library_dialog = None
+        self.singleInstanceAction = QAction("Single Instance Mode", self)
+        self.singleInstanceAction.setCheckable(True)
+        self.singleInstanceAction.triggered.connect(self.toggleSingleInstance)
+        self.fileMenu.insertAction(self.quitAction, self.singleInstanceAction)
+        self.autoReloadAction = QAction("Auto Reload Changed Files", self)
+        self.autoReloadAction.setCheckable(True)
+        self.autoReloadAction.triggered.connect(self.toggleAutoReload)
+        self.fileMenu.insertAction(self.quitAction, self.autoReloadAction)
+        # files are reloaded when there is no change for some time, as
+        # programs may write the file in several steps
+        self.file_watcher = QFileSystemWatcher(self)
+        self.file_watcher.fileChanged.connect(self.onFileChanged)
+        self.file_watcher.directoryChanged.connect(self.onDirectoryChanged)
+        self.reload_timer = QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.setInterval(500)
+        self.reload_timer.timeout.connect(self.reloadChangedFiles)
+        self.changed_files = set()
+        self.reloading = {} # {new doc_id : Document} of documents being reloaded
         self.exitPresentationAction = QAction("Exit Presentation", self)
         self.exitPresentationAction.setShortcut('Esc')
         self.exitPresentationAction.triggered.connect(self.exitPresentationMode)
@@ -239,6 +1133,9 @@ class Window(QMainWindow, Ui_window):
         self.firstPageAction.triggered.connect(self.goFirstPage)
         self.lastPageAction.triggered.connect(self.goLastPage)
         self.aboutAction.triggered.connect(self.showAbout)
+        workerFailuresAction = QAction("Worker Failures", self)
+        workerFailuresAction.triggered.connect(self.showWorkerFailures)
+        self.helpMenu.insertAction(self.aboutAction, workerFailuresAction)
         # Create widgets for menubar / toolbar
         self.gotoPageEdit = QLineEdit(self)
         self.gotoPageEdit.setPlaceholderText("Jump to page...")
@@ -299,8 +1196,49 @@ class Window(QMainWindow, Ui_window):
             filename = self.settings.value("Filename")
             self.file_history[filename] = self.settings.value("PageNo")
         self.settings.endArray()
+        # backend used for particular files, chosen by user
+        self.file_backends = {}# <filename : backend> dictionary
+        size = self.settings.beginReadArray("FileBackends")
+        for i in range(size):
+            self.settings.setArrayIndex(i)
+            self.file_backends[self.settings.value("Filename")] = self.settings.value("Backend")
+        self.settings.endArray()
+        # folders whose pdf files are indexed for library search
+        self.library_folders = []
+        size = self.settings.beginReadArray("LibraryFolders")
+        for i in range(size):
+            self.settings.setArrayIndex(i)
+            self.library_folders.append(self.settings.value("Folder"))
+        self.settings.endArray()
+        self.backend_choice = self.settings.value("Backend", backend)# auto | backend name
+        # measured once per file, as measuring renders a page with each backend
+        self.measured_backends = {}# <filename : fastest backend> dictionary
+        size = self.settings.beginReadArray("MeasuredBackends")
+        for i in range(size):
+            self.settings.setArrayIndex(i)
+            self.measured_backends[self.settings.value("Filename")] = self.settings.value("Backend")
+        self.settings.endArray()
         self.available_area = [desktop.availableGeometry().width(), desktop.availableGeometry().height()]
         self.zoomLevelCombo.setCurrentIndex(int(self.settings.value("ZoomLevel", 0)))
+        color_mode = self.settings.value("ColorMode", "color")
+        for action in self.colorModeMenu.actions():
+            action.setChecked(action.color_mode==color_mode)
+        filter_name = self.settings.value("PageFilter", "none")
+        if filter_name not in filters or not filtersAvailable():
+            filter_name = "none"
+        for action in self.pageFilterMenu.actions():
+            action.setChecked(action.filter_name==filter_name)
+        self.instance_server = None
+        if self.settings.value("SingleInstance", "false")=="true":
+            self.singleInstanceAction.setChecked(True)
+            self.toggleSingleInstance(True)
+        self.auto_reload = self.settings.value("AutoReload", "false")=="true"
+        if self.settings.value("ThumbnailDiskCache", "false")=="true":
+            self.thumbnailDiskCacheAction.setChecked(True)
+            pruneCacheDir(THUMBNAIL_DIR)
+        # max memory used by thumbnails of all documents
+        self.thumbnail_cache_limit = int(self.settings.value("ThumbnailCacheMB", 32))*1024*1024
+        self.autoReloadAction.setChecked(self.auto_reload)
         # Connect Signals
         self.scrollArea.verticalScrollBar().valueChanged.connect(self.onPageScroll)
         self.findTextEdit.returnPressed.connect(self.findNext)
@@ -311,12 +1249,35 @@ class Window(QMainWindow, Ui_window):
         # Initialize Variables
         App.window = self
         App.manager = Manager(self) # thread manager
+        App.manager.color_mode = color_mode
+        App.manager.filter_name = filter_name
+        # by default as many pages are kept as the old count based cache did, i.e
+        # 11 color pages of A4 size at screen width, but not less than 64 MB
+        page_size = 4*self.available_area[0]*self.available_area[0]*1.414
+        cache_mb = max(int(11*page_size/(1024*1024)), 64)
+        App.manager.cache_size_limit = int(self.settings.value("RenderCacheMB", cache_mb))*1024*1024
+        App.manager.warm_cache_limit = int(self.settings.value("WarmCacheMB", 64))*1024*1024
+        App.manager.job_timeout = int(self.settings.value("JobTimeoutSec", 30))
+        # memory is freed when there is no user input for this many seconds
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(int(self.settings.value("IdleReclaimSec", 60))*1000)
+        self.idle_timer.timeout.connect(self.onIdle)
+        if self.idle_timer.interval()>0:
+            QApplication.instance().installEventFilter(self)
+            self.idle_timer.start()
+        # in fit width mode, render dpi is rounded up to steps of this percent
+        self.dpi_bucket_step = float(self.settings.value("DpiBucketStep", 6))
         self.pages = [] # page widgets
+        self.pages_count = 0
+        self.curr_page_no = 1
         self.render_on_scroll = True
         self.jumped_from = None
         self.copy_text_mode = False
         self.presentation_mode = False
-        self.first_file_opened = False # to prevent resize trigger on program startup
+        self.search_text = ''
+        self.search_result_page = 0
+        self.first_file_opened = False
         self.updateRecentFilesMenu()
         QDir.setCurrent(QDir.homePath())
         # Show Window
@@ -329,7 +1290,7 @@ class Window(QMainWindow, Ui_window):
         else:
             self.show()
         loadPlugins(App)
-        if not App.plugins:
+        if self.pluginsMenu.isEmpty():
             self.pluginsMenu.menuAction().setVisible(False)
 
     def updateRecentFilesMenu(self):
@@ -351,61 +1312,404 @@ class Window(QMainWindow, Ui_window):
         self.file_history.clear()
         self.settings.remove("FileHistory")
 
-    def removeOldDoc(self):
-        if not App.doc:
+    def toggleSingleInstance(self, enable):
+        """ In single instance mode, new invocations pass their file to this window """
+        if enable and not self.instance_server:
+            self.instance_server = InstanceServer(self)
+            if not self.instance_server.start():
+                error = self.instance_server.error_message
+                self.instance_server.deleteLater()
+                self.instance_server = None
+                self.singleInstanceAction.setChecked(False)
+                QMessageBox.warning(self, "Failed !", "Could not start single instance mode.\n" + error)
+                return
+            self.instance_server.fileReceived.connect(self.onFileReceived)
+        elif not enable and self.instance_server:
+            self.instance_server.close()
+            self.instance_server.deleteLater()
+            self.instance_server = None
+        self.settings.setValue("SingleInstance", enable)
+
+    def onFileReceived(self, filename):
+        if self.presentation_mode:
+            self.exitPresentationMode()
+        if self.isMinimized():
+            self.showNormal()
+        self.raise_()
+        self.activateWindow()
+        self.loadPDFfile(filename)
+
+    def toggleAutoReload(self, enable):
+        """ In auto reload mode, documents are reloaded when their files are modified """
+        self.settings.setValue("AutoReload", enable)
+        self.auto_reload = enable
+        self.updateWatchedFiles()
+
+    def updateWatchedFiles(self):
+        """ watch files of opened documents in auto reload mode. Their directories
+        are also watched, as some programs replace the file instead of rewriting it """
+        files = {document.filename for document in App.documents} if self.auto_reload else set()
+        paths = files | {os.path.dirname(filename) for filename in files}
+        watched = set(self.file_watcher.files() + self.file_watcher.directories())
+        if watched - paths:
+            self.file_watcher.removePaths(list(watched - paths))
+        new_paths = [path for path in paths - watched if os.path.exists(path)]
+        if new_paths:
+            self.file_watcher.addPaths(new_paths)
+        # fingerprints of loaded files are required to find changed pages
+        for document in App.documents:
+            if self.auto_reload and document.fingerprints is None:
+                document.fingerprints = []# being computed
+                App.manager.request_fingerprints(document.id, document.filename,
+                                document.passwd, document.doc.name, document.doc.data)
+
+    def onFileChanged(self, filename):
+        # when file is replaced, watcher still watches the removed file
+        if filename in self.file_watcher.files() and os.path.exists(filename):
+            self.file_watcher.removePath(filename)
+            self.file_watcher.addPath(filename)
+        self.changed_files.add(filename)
+        self.reload_timer.start()
+
+    def onDirectoryChanged(self, path):
+        """ a replaced file is removed from watcher, so add it again """
+        watched = self.file_watcher.files()
+        for document in App.documents:
+            filename = document.filename
+            if os.path.dirname(filename)==path and filename not in watched and os.path.exists(filename):
+                self.file_watcher.addPath(filename)
+                self.onFileChanged(filename)
+
+    def reloadChangedFiles(self):
+        """ fingerprints of changed files are computed in worker threads,
+        then those files are reloaded """
+        for document in App.documents:
+            if document.filename in self.changed_files and os.path.exists(document.filename):
+                new_id = Document.newId()
+                self.reloading[new_id] = document
+                App.manager.request_fingerprints(new_id, document.filename,
+                                            document.passwd, document.doc.name)
+        self.changed_files.clear()
+
+    def onFingerprintsFinished(self, doc_id, fingerprints, data):
+        if doc_id in self.reloading:
+            document = self.reloading.pop(doc_id)
+            # document may be closed, or reloaded by a later request. fingerprints
+            # is empty when file could not be read, then file is being written
+            # and it will be reloaded on next change
+            if document in App.documents and doc_id>document.id and fingerprints:
+                self.reloadDocument(document, doc_id, fingerprints, data)
             return
-        self.updateFileHistory()
-        self.removeAllPages()
-        self.attachAction.setVisible(False)
+        for document in App.documents:
+            if document.id==doc_id:
+                document.fingerprints = fingerprints
+
+    def reloadDocument(self, document, new_id, fingerprints, data):
+        """ reload modified file from data read by worker. Rendered images of
+        unchanged pages are kept """
+        doc = PdfDocument(document.filename, document.doc.name, data)
+        if not doc.isValid() or (doc.isLocked() and not doc.unlock(document.passwd)):
+            return
+        old_fingerprints = document.fingerprints or []
+        changed_pages = [i+1 for i,fingerprint in enumerate(fingerprints)
+                    if i>=len(old_fingerprints) or fingerprint!=old_fingerprints[i]]
+        if not changed_pages and len(fingerprints)==len(old_fingerprints):
+            return
+        debug("Reload :", document.filename, "Changed pages :", changed_pages)
+        # workers load the file with new id, so that old pages being rendered are discarded
+        self.loadFileRequested.emit(new_id, document.filename, document.passwd, doc.name, doc.data)
+        self.closeFileRequested.emit(document.id)
+        page_sizes = [doc.pageSize(i) for i in range(1, len(fingerprints)+1)]
+        same_layout = page_sizes==document.page_sizes
+        unchanged_pages = set(range(1, len(fingerprints)+1)) - set(changed_pages)
+        App.manager.text_cache.reloadDocument(document.id, new_id, unchanged_pages)
+        document.id, document.doc = new_id, doc
+        document.fingerprints, document.page_sizes = fingerprints, page_sizes
+        document.pages_count = len(fingerprints)
+        document.curr_page_no = min(document.curr_page_no, document.pages_count)
+        document.has_attachments = bool(doc.hasEmbeddedFiles())
+        document.outline_model = None
+        document.file_stat = os.stat(document.filename)
+        for page_no in list(document.thumbnails.keys()):
+            if page_no in changed_pages or page_no>document.pages_count:
+                document.thumbnails.pop(page_no)
+        for page_no in list(document.render_costs.keys()):
+            if page_no in changed_pages or page_no>document.pages_count:
+                document.render_costs.pop(page_no)
+        if document is self.thumbnail_doc:
+            self.thumbnail_doc = None # thumbnails are shown again
+            self.updateThumbnails()
+        is_current = document is App.document
+        if is_current and self.presentation_mode and not same_layout:
+            self.exitPresentationMode()
+        caches = [document.render_cache, document.warm_cache, document.failed_pages,
+                    document.timed_out_pages] + list(document.filter_caches.values())
+        if is_current:
+            caches.append(App.manager.render_cache)
+        for cache in caches:
+            for page_no in list(cache.keys()):
+                if page_no in changed_pages or page_no>document.pages_count:
+                    cache.pop(page_no)
+        if not is_current:
+            if not same_layout:
+                # images of unchanged pages may be of old size too, and
+                # pages are added again when the tab is shown
+                document.render_cache.clear()
+                document.warm_cache.clear()
+                document.filter_caches.clear()
+                document.page_dpis.clear()
+                if document.frame:
+                    document.frame.deleteLater()
+                document.frame, document.pages = None, []
+            elif document.frame:
+                for page_no in changed_pages:
+                    document.pages[page_no-1].clear()
+            return
+        # update current document
+        App.doc = doc
+        self.clearSearchHighlight()
+        self.pages_count = document.pages_count
+        self.curr_page_no = min(self.curr_page_no, self.pages_count)
         self.jumped_from = None
-        self.updateRecentFilesMenu()
+        self.attachAction.setVisible(document.has_attachments)
+        self.pageNoLabel.setText('<b>%i/%i</b>' % (self.curr_page_no, self.pages_count) )
+        self.gotoPageValidator.setTop(self.pages_count)
+        self.showOutlines()
+        if self.presentation_mode:
+            if self.curr_page_no in changed_pages:
+                self.showCurrentSlide()
+            return
+        if same_layout:
+            for page_no in changed_pages:
+                self.pages[page_no-1].clear()
+            self.renderCurrentPage()
+            return
+        # rebuild page widgets, keeping scroll position
+        scroll_pos = (self.scrollArea.verticalScrollBar().value(),
+                        self.scrollArea.horizontalScrollBar().value())
+        self.render_on_scroll = False
+        self.frame.hide()
+        self.frame.deleteLater()# page widgets are deleted with it
+        App.page_dpis.clear()
+        self.addPages()
+        self.showCachedPages()
+        self.scrollArea.verticalScrollBar().setValue(scroll_pos[0])
+        self.scrollArea.horizontalScrollBar().setValue(scroll_pos[1])
+        self.renderCurrentPage()
 
-    def loadPDFfile(self, filename):
-        """ Loads pdf document in all threads """
+    def updateBackendMenu(self):
+        self.backendMenu.clear()
+        group = QActionGroup(self.backendMenu)
+        for name in ["auto"] + availableBackends():
+            title = "Default : Fastest for Each File" if name=="auto" else "Default : " + name
+            action = self.backendMenu.addAction(title, self.setDefaultBackend)
+            action.setCheckable(True)
+            action.setChecked(name==self.backend_choice)
+            action.backend = name
+            group.addAction(action)
+        if not App.doc:
+            return
+        self.backendMenu.addSeparator()
+        for name in availableBackends():
+            action = self.backendMenu.addAction("Reopen This File With " + name, self.setFileBackend)
+            action.setEnabled(name!=App.doc.name)
+            action.backend = name
+
+    def setDefaultBackend(self):
+        self.backend_choice = self.sender().backend
+        self.settings.setValue("Backend", self.backend_choice)
+
+    def setFileBackend(self):
+        """ Reopen current file with another backend, and use that backend for this file """
+        backend_name = self.sender().backend
+        if not loadBackend(backend_name):
+            return
+        filename, password = App.filename, App.passwd
+        self.file_backends[collapseUser(filename)] = backend_name
+        self.closeDocument(App.document)
+        self.loadPDFfile(filename, password)
+
+    def loadPDFfile(self, filename, password=''):
+        """ Loads pdf document in a new tab and in all threads. If the file is
+        already opened, switches to its tab. password is tried before asking user """
         debug("opening : ", filename)
         filename = os.path.expanduser(filename)
-        doc = PdfDocument(filename)
+        for i,document in enumerate(App.documents):
+            if document.filename==filename:
+                if self.presentation_mode:
+                    self.exitPresentationMode()
+                self.tabBar.setCurrentIndex(i)
+                return
+        # backend chosen for this file, otherwise default or auto
+        backend_name = self.file_backends.get(collapseUser(filename), self.backend_choice)
+        # file is read once, all threads open the document from this data
+        data = readFile(filename)
+        doc = PdfDocument(filename, backend_name, data)
         if not doc.isValid():
             return
-        password = ''
-        if doc.isLocked() :
+        if not doc.isLocked():
+            password = ''
+        elif not (password and doc.unlock(password)):
             password = QInputDialog.getText(self, 'This PDF is locked', 'Enter Password :', 2)[0]
             if password == '' :
-                if App.doc == None: sys.exit(1)#exit if first document
+                if not self.first_file_opened: sys.exit(1)#exit if first document
                 else : return
             unlocked = doc.unlock(password)
             if not unlocked:
                 return QMessageBox.critical(self, "Failed !","Incorrect Password")
-            App.passwd = password
-            self.lockUnlockAction.setText("Save Unlocked")
-        else:
-            self.lockUnlockAction.setText("Encrypt PDF")
-        self.removeOldDoc()
-        App.doc = doc
-        App.filename = filename
-        self.pages_count = App.doc.pageCount()
-        self.curr_page_no = 1
-        self.getOutlines()
+        if backend_name=="auto":
+            key = collapseUser(filename)
+            # moved to end, as only the 100 most recent are saved
+            fastest = self.measured_backends.pop(key, None) or fastestBackend(filename, password, data)
+            self.measured_backends[key] = fastest
+            if fastest!=doc.name:
+                doc = PdfDocument(filename, fastest, data)
+                if doc.isLocked():
+                    doc.unlock(password)
+        if self.presentation_mode:
+            self.exitPresentationMode()
+        document = Document(doc, filename, password)
+        self.loadRenderCosts(document)
         # Load Document in other threads
-        self.loadFileRequested.emit(App.filename, password)
+        self.loadFileRequested.emit(document.id, filename, password, doc.name, doc.data)
         if collapseUser(filename) in self.file_history:
             page_no = int(self.file_history[collapseUser(filename)])
-            self.curr_page_no = min(page_no, self.pages_count)
-        # Show/Add widgets
-        if App.doc.hasEmbeddedFiles():
-            self.attachAction.setVisible(True)
+            document.curr_page_no = min(page_no, document.pages_count)
+        App.documents.append(document)
+        self.tabBar.blockSignals(True)
+        index = self.tabBar.addTab(elideMiddle(os.path.basename(filename), 30))
+        self.tabBar.setTabToolTip(index, collapseUser(filename))
+        self.tabBar.setCurrentIndex(index)
+        self.tabBar.blockSignals(False)
+        self.showDocument(document)
+        self.updateWatchedFiles()
+        self.first_file_opened = True
+        self.fileOpened.emit(App.filename)
+
+    def onTabChange(self, index):
+        if index>=0:
+            self.showDocument(App.documents[index])
+
+    def onTabCloseRequest(self, index):
+        self.closeDocument(App.documents[index])
+
+    def saveDocumentState(self):
+        """ save view state of current document, before switching to another """
+        document = App.document
+        if not document:
+            return
+        document.curr_page_no = self.curr_page_no
+        document.jumped_from = self.jumped_from
+        document.scroll_pos = (self.scrollArea.verticalScrollBar().value(),
+                                self.scrollArea.horizontalScrollBar().value())
+
+    def showDocument(self, document):
+        """ make document current, and show its pages """
+        if document is App.document:
+            return
+        if App.document:
+            self.saveDocumentState()
+            self.clearSearchHighlight()
+            self.render_on_scroll = False
+            self.frame.hide()
+        App.document = document
+        App.doc, App.filename, App.passwd = document.doc, document.filename, document.passwd
+        App.page_dpis = document.page_dpis
+        App.manager.render_cache = document.render_cache
+        App.manager.text_requests.clear()# these were of previous document
+        self.pages_count = document.pages_count
+        self.curr_page_no = document.curr_page_no
+        self.jumped_from = document.jumped_from
+        self.lockUnlockAction.setText("Save Unlocked" if document.passwd else "Encrypt PDF")
+        self.attachAction.setVisible(document.has_attachments)
         self.pageNoLabel.setText('<b>%i/%i</b>' % (self.curr_page_no, self.pages_count) )
         self.gotoPageValidator.setTop(self.pages_count)
         self.setWindowTitle(os.path.basename(App.filename)+ " - PDF Bunny " + __version__)
-        # load pages
-        self.addPages()
-        self.first_file_opened = True
-        self.fileOpened.emit(App.filename)
+        self.showOutlines()
+        self.updateThumbnails()
+        if not document.frame:
+            # load pages
+            self.addPages()
+            self.showCachedPages()
+            return
+        self.frame, self.pages = document.frame, document.pages
+        self.frame.show()
+        # show pages rendered while the document was in background
+        self.showCachedPages()
+        # zoom or window size might have changed while the document was in background
+        if document.page_layout!=self.pageLayout():
+            old_dpis, old_display_dpis = App.page_dpis.copy(), document.display_dpis.copy()
+            self.calculatePageDpis()
+            if App.page_dpis != old_dpis:
+                App.manager.clear_cache()
+            if document.display_dpis != old_display_dpis:
+                self.resizePages()
+                self.jumpToPage(self.curr_page_no)
+                self.jumped_from = document.jumped_from
+                return
+        self.scrollLayout.activate()
+        self.scrollArea.verticalScrollBar().setValue(document.scroll_pos[0])
+        self.scrollArea.horizontalScrollBar().setValue(document.scroll_pos[1])
+        self.render_on_scroll = True
+        self.renderCurrentPage()
+
+    def showCachedPages(self):
+        """ set already rendered images to page widgets which have no image """
+        for page_no, image in App.manager.render_cache.items():
+            if self.pages[page_no-1].image.isNull():
+                self.pages[page_no-1].setImage(image, App.doc.pageLinkAnnotations(page_no))
+        for page_no, error in App.document.failed_pages.items():
+            if page_no<=len(self.pages):
+                self.pages[page_no-1].showError(error)
+
+    def closeDocument(self, document):
+        self.exitPresentationMode()
+        self.saveDocumentState()
+        self.updateFileHistory(document)
+        self.saveRenderCosts(document)
+        index = App.documents.index(document)
+        App.documents.remove(document)
+        self.closeFileRequested.emit(document.id)
+        if document is App.document:
+            self.clearSearchHighlight()
+            self.search_text = ''
+            self.removeAllPages()
+            App.manager.search_text = None
+            App.document = None
+        else:
+            document.render_cache.clear()
+            document.warm_cache.clear()
+            if document.frame:
+                document.frame.deleteLater()
+        self.tabBar.blockSignals(True)
+        self.tabBar.removeTab(index)
+        self.tabBar.blockSignals(False)
+        if not App.document:
+            if App.documents:
+                self.showDocument(App.documents[self.tabBar.currentIndex()])
+            else:
+                self.showNoDocument()
+        self.updateWatchedFiles()
+        self.updateRecentFilesMenu()
+
+    def showNoDocument(self):
+        """ reset window after all documents are closed """
+        App.doc, App.filename, App.passwd = None, '', ''
+        App.page_dpis = {}
+        App.manager.render_cache = {}
+        App.manager.text_requests.clear()
+        self.pages, self.pages_count, self.curr_page_no = [], 0, 1
+        self.jumped_from = None
+        self.attachAction.setVisible(False)
+        self.dockWidget.hide()
+        self.pageNoLabel.setText("")
+        self.setWindowTitle("PDF Bunny - " + __version__)
+        self.updateThumbnails()
 
     def onNewPageRendered(self, page_no, image):
         if self.presentation_mode:
             if page_no == self.curr_page_no:
-                self.pages[0].setImage(image)
+                self.pages[0].setImage(image, App.doc.pageLinkAnnotations(page_no))
             return
         # though i have never seen, when loading file
         # the page may be rendered before adding pages.
@@ -413,8 +1717,20 @@ class Window(QMainWindow, Ui_window):
             links = App.doc.pageLinkAnnotations(page_no)
             self.pages[page_no-1].setImage(image, links)
 
-    def clearPageImage(self, page_no):
-        """ To save memory, clear pixmap """
+    def onPageRenderFailed(self, page_no, error):
+        if self.presentation_mode:
+            if page_no==self.curr_page_no:
+                self.pages[0].showError(error)
+        elif page_no<=len(self.pages):
+            self.pages[page_no-1].showError(error)
+
+    def clearPageImage(self, page_no, document=None):
+        """ To save memory, clear pixmap. document is None for current document """
+        if document:
+            # pages of a background tab are removed when its page layout changes
+            if document.frame:
+                document.pages[page_no-1].clear()
+            return
         if self.presentation_mode:
             return
         self.pages[page_no-1].clear()
@@ -422,12 +1738,20 @@ class Window(QMainWindow, Ui_window):
     def renderCurrentPage(self):
         """ Requests manager to render current page """
         App.manager.set_current_page_no(self.curr_page_no)
+        if self.thumbnail_doc and self.thumbnailView.currentRow()!=self.curr_page_no-1:
+            self.thumbnailView.setCurrentRow(self.curr_page_no-1)
 
     def onPageScroll(self, pos):
         """ It is called when vertical scrollbar value is changed.
             Get the current page number on scrolling, then requests to render"""
         if not self.render_on_scroll:
             return
+        # fast scrolling is at least two viewport heights per second
+        now = time.monotonic()
+        if self.last_scroll and abs(pos-self.last_scroll[0]) > 2*self.scrollArea.viewport().height()*(now-self.last_scroll[1]):
+            App.manager.set_draft_mode(True)
+            self.scroll_stop_timer.start(150)
+        self.last_scroll = (pos, now)
         # we have to also check little lower to avoid page spacings
         for dy in (0,20):
             child = self.frame.childAt(int(self.frame.width()/2), int(pos)+dy)
@@ -438,6 +1762,9 @@ class Window(QMainWindow, Ui_window):
                 self.renderCurrentPage()
                 break
 
+    def onScrollStop(self):
+        App.manager.set_draft_mode(False)
+
     def addPages(self):
         """ add pages for normal mode """
         self.calculatePageDpis()
@@ -446,6 +1773,8 @@ class Window(QMainWindow, Ui_window):
         self.render_on_scroll = False
         self.frame = Frame(self.scrollAreaWidgetContents, self.scrollArea)
         self.scrollLayout.addWidget(self.frame)
+        self.pages = []
+        App.document.frame, App.document.pages = self.frame, self.pages
         # Add page widgets
         for page_no in range(1, self.pages_count+1):
             page = PageWidget(page_no, self.frame)
@@ -455,8 +1784,10 @@ class Window(QMainWindow, Ui_window):
         self.resizePages()
         if self.curr_page_no!=1:
             self.jumpToPage(self.curr_page_no)
+            self.jumped_from = None
 
     def removeAllPages(self):
+        self.render_on_scroll = False# frame is being deleted
         App.manager.clear_cache()# remove old rendered images
         App.page_dpis.clear()
         while self.pages:
@@ -465,27 +1796,39 @@ class Window(QMainWindow, Ui_window):
             page.deleteLater()
         self.frame.deleteLater()
 
+    def pageLayout(self):
+        """ returns zoom level and viewport width on which page dpis depend """
+        if self.zoomLevelCombo.currentIndex() != 0:
+            return self.zoomLevelCombo.currentIndex(), 0
+        return 0, self.scrollArea.viewport().width()
+
     def calculatePageDpis(self):
         if self.zoomLevelCombo.currentIndex() != 0:
             percent_zoom = self.zoom_levels[self.zoomLevelCombo.currentIndex()]
             dpi = int(SCREEN_DPI*percent_zoom/100)
             for i in range(self.pages_count):
                 App.page_dpis[i+1] = dpi
+                App.document.display_dpis[i+1] = dpi
+            App.document.page_layout = self.pageLayout()
             return
-        # Fit width
+        # Fit width. Pages are rendered at slightly higher dpi and scaled down
+        # while painting, so that small window resizes reuse rendered images.
         wait(100) # get proper viewport width
         fixed_width = self.scrollArea.viewport().width() - 30
         for page_no in range(1, self.pages_count+1):
             page_w, page_h = App.doc.pageSize(page_no) # width in points
-            App.page_dpis[page_no] = int(72.0*fixed_width/page_w)
+            dpi = int(72.0*fixed_width/page_w)
+            App.document.display_dpis[page_no] = dpi
+            App.page_dpis[page_no] = dpiBucket(dpi, self.dpi_bucket_step)
+        App.document.page_layout = self.pageLayout()
 
     def resizePages(self):
         ''' Resize all pages according to zoom level '''
         self.render_on_scroll = False
         for i in range(self.pages_count):
             page_w, page_h = App.doc.pageSize(i+1) # width in points
-            dpi = App.page_dpis[i+1]
-            self.pages[i].dpi = dpi
+            dpi = App.document.display_dpis[i+1]
+            self.pages[i].setDpi(dpi)
             self.pages[i].setFixedSize(int(round(page_w*dpi/72)), int(round(page_h*dpi/72)))
         # wait for resize to take effect
         wait(100)
@@ -505,8 +1848,15 @@ class Window(QMainWindow, Ui_window):
         self.toolBar.hide()
         self.menubar.hide()
         self.dockWidget.hide()
-        # Remove all pages
-        self.removeAllPages()
+        self.thumbnailDock.hide()
+        self.tabBar.hide()
+        # Keep pages and rendered images of normal mode, so that they need
+        # not be rendered again when we exit presentation mode
+        self.frame.hide()
+        self.pages = []
+        App.manager.render_cache = {}
+        App.page_dpis = {}
+        App.manager.prefetch_count = int(self.settings.value("PresentationPrefetch", 3))
         # in presentation mode, we need to add only one page
         self.frame = Frame(self.scrollAreaWidgetContents, self.scrollArea)
         self.scrollLayout.addWidget(self.frame)
@@ -531,6 +1881,13 @@ class Window(QMainWindow, Ui_window):
         if not self.presentation_mode:
             return
         self.removeAllPages()
+        # restore pages of normal mode
+        self.frame, self.pages = App.document.frame, App.document.pages
+        App.manager.render_cache = App.document.render_cache
+        App.page_dpis = App.document.page_dpis
+        App.manager.prefetch_count = 1
+        self.frame.show()
+        self.tabBar.setVisible(self.tabBar.count()>1)
         self.setWindowState(self.window_state[0])# restores normal or maximized state
         self.restoreState(self.window_state[1])# restores menubar, toolbar and dockwidgets
         self.scrollArea.setStyleSheet("QScrollArea { background-color: #efefef; }")
@@ -538,16 +1895,21 @@ class Window(QMainWindow, Ui_window):
         wait(50)# in this time, resizeEvent() is called
         self.render_on_scroll = True
         self.presentation_mode = False
-        self.addPages()
+        self.jumpToPage(self.curr_page_no)
+        # window size may differ from when we entered presentation mode
+        self.resize_page_timer.start(200)
 
     def showCurrentSlide(self):
         """ show presentation slide """
         self.pages[0].clear()
         dpi = App.page_dpis[self.curr_page_no]
         page_w, page_h = App.doc.pageSize(self.curr_page_no) # size in points
+        self.pages[0].dpi = dpi
         self.pages[0].setFixedSize(int(round(page_w*dpi/72)), int(round(page_h*dpi/72)))
         if image := App.manager.render_cache.get(self.curr_page_no,None):
-            self.pages[0].setImage(image)
+            self.pages[0].setImage(image, App.doc.pageLinkAnnotations(self.curr_page_no))
+        elif self.curr_page_no in App.document.failed_pages:
+            self.pages[0].showError(App.document.failed_pages[self.curr_page_no])
         self.renderCurrentPage()
 
 
@@ -559,22 +1921,17 @@ class Window(QMainWindow, Ui_window):
             self.loadPDFfile(filename)
 
     def lockUnlock(self):
-        if which("qpdf")==None :
+        if not EncryptionJob.isAvailable():
             self.lockUnlockAction.setEnabled(False)
-            QMessageBox.warning(self, "qpdf Required","qpdf command not found.\nInstall qpdf program.")
+            QMessageBox.warning(self, "Not Available", "Saving locked or unlocked copy requires "
+                            "qpdf program, or PyMuPDF backend.\nInstall qpdf or PyMuPDF.")
             return
         if self.lockUnlockAction.text()=="Encrypt PDF":
             self.encryptPDF()
             return
         filename, ext = os.path.splitext(App.filename)
         new_name = filename + "-unlocked.pdf"
-        proc = Popen(["qpdf", "--decrypt", "--password="+App.passwd, App.filename, new_name])
-        stdout, stderr = proc.communicate()
-        if proc.returncode==0:
-            notifier = Notifier(self)
-            notifier.showNotification("Successful !", "File saved as\n"+os.path.basename(new_name))
-        else:
-            QMessageBox.warning(self, "Failed !", "Failed to save as unlocked")
+        self.startEncryptionJob(new_name, App.passwd, True)
 
     def encryptPDF(self):
         password, ok = QInputDialog.getText(self, "Lock PDF", "Enter Password :",
@@ -583,14 +1940,41 @@ class Window(QMainWindow, Ui_window):
             return
         filename, ext = os.path.splitext(App.filename)
         new_name = filename + "-locked.pdf"
-        proc = Popen(["qpdf", "--encrypt", password, password, '128', '--', App.filename, new_name])
-        stdout, stderr = proc.communicate()
-        if proc.returncode == 0:
-            basename = os.path.basename(new_name)
+        self.startEncryptionJob(new_name, password, False)
+
+    def startEncryptionJob(self, new_name, password, decrypt):
+        """ encrypts or decrypts in background, while showing progress """
+        job = EncryptionJob(self, App.filename, new_name, password, decrypt)
+        title = "Saving Unlocked" if decrypt else "Saving Encrypted"
+        dlg = QProgressDialog(title + " : " + os.path.basename(new_name), "Cancel", 0, 100, self)
+        dlg.setWindowTitle(title)
+        dlg.setMinimumDuration(500)
+        dlg.setAutoClose(False)
+        dlg.setAutoReset(False)
+        if not which("qpdf"):
+            dlg.setMaximum(0)# progress is unknown
+        dlg.canceled.connect(job.cancel)
+        job.progressChanged.connect(dlg.setValue)
+        job.fallbackStarted.connect(partial(self.onEncryptionFallback, dlg))
+        job.finished.connect(partial(self.onEncryptionJobFinished, dlg, new_name, decrypt))
+        job.start()
+
+    def onEncryptionFallback(self, dlg, error):
+        """ qpdf failed to start, and file is being saved using backend """
+        dlg.setMaximum(0)# progress is unknown
+        dlg.setLabelText(error + "\nSaving using " + backendWithCapability("encrypt"))
+
+    def onEncryptionJobFinished(self, dlg, new_name, decrypt, success, error):
+        cancelled = dlg.wasCanceled()
+        dlg.deleteLater()
+        if cancelled:
+            return
+        if success:
             notifier = Notifier(self)
-            notifier.showNotification("Successful !", "File saved as\n"+basename)
+            notifier.showNotification("Successful !", "File saved as\n"+os.path.basename(new_name))
         else:
-            QMessageBox.warning(self, "Failed !", "Failed to save as Encrypted")
+            message = "Failed to save as unlocked" if decrypt else "Failed to save as Encrypted"
+            QMessageBox.warning(self, "Failed !", message + ("\n" + error if error else ""))
 
     def printFile(self):
         if which("quikprint"):
@@ -673,6 +2057,9 @@ class Window(QMainWindow, Ui_window):
         else: # fit to page (need to calculate for each page)
             scale = 0
 
+        # tried Poppler.Page.renderToPainter() but always fails
+        images = self.renderPagesWithProgress([page_no for page_no in range(from_page, to_page+1)
+                            if page_no in page_nos], render_dpi, "Printing")
         painter = QPainter(printer)
         for page_no in range(from_page, to_page+1):
             if page_no!=from_page:
@@ -681,8 +2068,10 @@ class Window(QMainWindow, Ui_window):
                 painter.resetTransform()
             if page_no not in page_nos:
                 continue
-            # tried Poppler.Page.renderToPainter() but always fails
-            img = App.doc.renderPage(page_no, render_dpi)
+            img = next(images, None)
+            if img is None:# cancelled
+                printer.abort()
+                break
             rect = painter.viewport()
             scale_ = scale or min(rect.width()/img.width(), rect.height()/img.height())
             painter.scale(scale_, scale_)
@@ -690,17 +2079,42 @@ class Window(QMainWindow, Ui_window):
         painter.end()
 
 
+    def renderPagesWithProgress(self, page_nos, dpi, title):
+        """ yields rendered images of pages. progress dialog shows time left,
+        estimated from measured render times. stops if cancelled """
+        dlg = QProgressDialog(title, "Cancel", 0, len(page_nos), self)
+        dlg.setWindowModality(Qt.WindowModal)
+        dlg.setMinimumDuration(1000)
+        for i, page_no in enumerate(page_nos):
+            time_left = App.manager.estimate_render_time(App.document, page_nos[i:], dpi)
+            dlg.setLabelText("%s page %i" % (title, page_no) + (" ... about %i seconds left"
+                                % math.ceil(time_left) if time_left else ""))
+            dlg.setValue(i)
+            if dlg.wasCanceled():
+                return
+            start = time.perf_counter()
+            img = App.doc.renderPage(page_no, dpi)
+            App.manager.add_render_time(App.document, page_no, dpi, time.perf_counter()-start)
+            yield img
+        dlg.setValue(len(page_nos))
+
     def exportPageToImage(self):
         dialog = ExportToImageDialog(self.curr_page_no, self.pages_count, self)
         if dialog.exec_() == QDialog.Accepted:
             try:
                 dpi = int(dialog.dpiEdit.text())
-                for page_no in range(dialog.pageNoSpin.value(), dialog.toPageNoSpin.value()+1):
+                page_nos = list(range(dialog.pageNoSpin.value(), dialog.toPageNoSpin.value()+1))
+                saved_count = 0
+                for page_no, img in zip(page_nos, self.renderPagesWithProgress(page_nos, dpi, "Exporting")):
                     filename = os.path.splitext(App.filename)[0]+'-'+str(page_no)+'.jpg'
-                    img = App.doc.renderPage(page_no, dpi)
                     img.save(filename)
+                    saved_count += 1
                 notifier = Notifier(self)
-                notifier.showNotification("Successful !","Image(s) has been saved")
+                if saved_count<len(page_nos):# cancelled
+                    notifier.showNotification("Cancelled !","%i of %i Image(s) has been saved"
+                                                % (saved_count, len(page_nos)))
+                else:
+                    notifier.showNotification("Successful !","Image(s) has been saved")
             except:
                 QMessageBox.warning(self, "Failed !","Failed to export to Image")
 
@@ -718,6 +2132,8 @@ class Window(QMainWindow, Ui_window):
         elif page_num > self.pages_count: page_num = self.pages_count
         self.jumped_from = self.curr_page_no
         self.curr_page_no = page_num
+        if page_num!=self.jumped_from:# not a jump after resize
+            self.pageJumped.emit(page_num, top)
         if self.presentation_mode:
             self.showCurrentSlide()
             return
@@ -725,6 +2141,7 @@ class Window(QMainWindow, Ui_window):
         if not (0 < top < self.pages[page_num-1].height()): top = 0
         scrollbar_pos = self.pages[page_num-1].pos().y()
         scrollbar_pos += top
+        self.last_scroll = None# jumped pages are not drafts
         if int(scrollbar_pos) != self.scrollArea.verticalScrollBar().value():
             self.scrollArea.verticalScrollBar().setValue(int(scrollbar_pos))
         else:# when scrollbar value does not change
@@ -759,6 +2176,8 @@ class Window(QMainWindow, Ui_window):
 
     def setZoom(self, index):
         """ Gets called when zoom level is changed"""
+        if not App.doc:
+            return
         scrollbar = self.scrollArea.verticalScrollBar()
         rel_pos = scrollbar.value()/scrollbar.maximum() if scrollbar.maximum() else 0
         App.manager.clear_cache()# remove old rendered images
@@ -770,6 +2189,34 @@ class Window(QMainWindow, Ui_window):
         else:
             self.renderCurrentPage()
 
+    def setColorMode(self):
+        """ grayscale images use one byte per pixel instead of four """
+        color_mode = self.sender().color_mode
+        self.settings.setValue("ColorMode", color_mode)
+        App.manager.set_color_mode(color_mode)
+        if App.doc:
+            self.renderCurrentPage()
+
+    def setPageFilter(self):
+        """ images of the new filter are created from cached unfiltered images
+        in worker threads, if available """
+        filter_name = self.sender().filter_name
+        self.settings.setValue("PageFilter", filter_name)
+        App.manager.set_filter(filter_name)
+        # images of previous filter are shown in other tabs
+        for document in App.documents:
+            if document is not App.document and document.frame:
+                for page in document.pages:
+                    page.clear()
+        if not App.doc:
+            return
+        if self.presentation_mode:
+            return self.showCurrentSlide()
+        for page in self.pages:
+            page.clear()
+        self.showCachedPages()
+        self.renderCurrentPage()
+
     def zoomIn(self):
         index = self.zoomLevelCombo.currentIndex()
         if index == len(self.zoom_levels) - 1 : return
@@ -792,9 +2239,8 @@ class Window(QMainWindow, Ui_window):
           self.findTextEdit.setFocus()
           self.search_text = ''
           self.search_result_page = 0
-        elif self.search_result_page != 0:
-          self.pages[self.search_result_page-1].highlight_area = None
-          self.pages[self.search_result_page-1].updateImage()
+        else:
+          self.clearSearchHighlight()
 
     def findText(self, text, direction):
         """ direction is +1 for forward and -1 for backward """
@@ -806,11 +2252,15 @@ class Window(QMainWindow, Ui_window):
         else:
             search_from_page = self.search_result_page + direction
         App.manager.find_text(text, search_from_page, direction)
-        if self.search_result_page != 0:     # clear previous highlights
+        self.textSearched.emit(text, direction)
+        self.clearSearchHighlight()
+        self.search_text = text
+
+    def clearSearchHighlight(self):
+        if self.search_result_page != 0:
             self.pages[self.search_result_page-1].highlight_area = None
             self.pages[self.search_result_page-1].updateImage()
             self.search_result_page = 0
-        self.search_text = text
 
     def findNext(self):
         self.findText(self.findTextEdit.text(), +1)
@@ -824,8 +2274,7 @@ class Window(QMainWindow, Ui_window):
             return
         self.pages[page_no-1].highlight_area = areas
         self.search_result_page = page_no
-        if self.pages[page_no-1].pixmap():
-            self.pages[page_no-1].updateImage()
+        self.pages[page_no-1].updateImage()
         first_result_pos = areas[0][1]
         self.jumpToPage(page_no, first_result_pos)
 
@@ -837,20 +2286,55 @@ class Window(QMainWindow, Ui_window):
     def copyText(self, page_no, rect):
         zoom = self.pages[page_no-1].dpi/72
         rect = [x/zoom for x in rect]
-        # Copy text to clipboard
-        text = App.doc.getPageText(page_no, rect)
-        QApplication.clipboard().setText(text)
         self.copyTextAction.setChecked(False)
         self.toggleCopyText(False)
+        # text layer is extracted in worker thread, so that gui is not blocked
+        App.manager.request_text_layer(page_no,
+            lambda layer: self.copyWords(page_no, layer, layer.wordsInRect(rect)))
+
+    def copyWordAt(self, page_no, pos, whole_line=False):
+        """ copy word (or whole line) under pos of page widget """
+        zoom = self.pages[page_no-1].dpi/72
+        x, y = pos.x()/zoom, pos.y()/zoom
+        def onTextLayerReady(layer):
+            index = layer.wordAt(x, y)
+            if index<0:
+                return
+            indexes = layer.lineWords(layer.line_nos[index]) if whole_line else [index]
+            self.copyWords(page_no, layer, indexes)
+        App.manager.request_text_layer(page_no, onTextLayerReady)
+
+    def copyWords(self, page_no, layer, indexes):
+        """ Copy text to clipboard, and highlight the copied words """
+        if not indexes:
+            return
+        QApplication.clipboard().setText(layer.getText(indexes))
+        if page_no<=len(self.pages) and not self.presentation_mode:
+            self.pages[page_no-1].showSelection(layer.wordRects(indexes))
 
 ##########      Other Functions      ##########
 
-    def getOutlines(self):
-        toc = App.doc.toc()
-        if not toc:
+    def showOutlines(self):
+        """ show outlines of current document, outlines are loaded only once """
+        if App.document.outline_model is None:
+            App.document.outline_model = self.getOutlines() or False
+        if not App.document.outline_model:
             self.dockWidget.hide()
             return
         self.dockWidget.show()
+        self.treeView.setModel(App.document.outline_model)
+        if App.document.outline_model.invisibleRootItem().rowCount() < 4:
+            self.treeView.expandToDepth(0)
+        self.treeView.setHeaderHidden(True)
+        self.treeView.header().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.treeView.header().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        self.treeView.header().setStretchLastSection(False)
+
+    def getOutlines(self):
+        """ returns outline model of current document, or None if it has no outlines """
+        toc = App.doc.toc()
+        if not toc:
+            return None
         outline_model = QStandardItemModel(self)
         root_item = outline_model.invisibleRootItem()
         parent_items = [root_item]
@@ -872,14 +2356,106 @@ class Window(QMainWindow, Ui_window):
             while len(parent_items)!=level:
                 parent_items.pop()
             parent_items.append(item)
+        return outline_model
+
+    def updateThumbnails(self):
+        """ show thumbnails of current document, when thumbnails dock is visible """
+        if not (App.document and self.thumbnailDock.isVisible()):
+            self.thumbnail_doc = None
+            self.thumbnailView.clear()
+            App.manager.request_thumbnails(0, [], THUMBNAIL_WIDTH, "")
+            return
+        if self.thumbnail_doc is App.document:
+            return
+        self.thumbnail_doc = App.document
+        self.thumbnailView.clear()
+        # blank icon sets item size before thumbnail is rendered
+        blank = QPixmap(self.thumbnailView.iconSize())
+        blank.fill(Qt.white)
+        self.blank_thumbnail = QIcon(blank)
+        for page_no in range(1, App.document.pages_count+1):
+            image = App.document.thumbnails.get(page_no)
+            icon = QIcon(QPixmap.fromImage(image)) if image else self.blank_thumbnail
+            QListWidgetItem(icon, str(page_no), self.thumbnailView)
+        self.thumbnailView.setCurrentRow(self.curr_page_no-1)
+        self.thumbnailView.scrollToItem(self.thumbnailView.currentItem())
+        cache_dir = self.thumbnailCacheDir(App.document)
+        if os.path.isdir(cache_dir):
+            os.utime(cache_dir)# so that it is not pruned
+        self.requestThumbnails()
+
+    def requestThumbnails(self):
+        """ request thumbnails which are not rendered yet, visible ones first """
+        document = self.thumbnail_doc
+        if not document:
+            return
+        viewport = self.thumbnailView.viewport()
+        first = max(self.thumbnailView.indexAt(QPoint(viewport.width()//2, 5)).row(), 0)
+        # visible pages, then next pages, then previous pages. only as many
+        # pages around visible ones are rendered as fit in thumbnail cache
+        max_count = self.thumbnail_cache_limit // (2*THUMBNAIL_WIDTH*int(THUMBNAIL_WIDTH*1.5))
+        order = list(range(first+1, document.pages_count+1)) + list(range(1, first+1))
+        page_nos = [page_no for page_no in order if page_no not in document.thumbnails
+                        and abs(page_no-first-1) < max_count//2]
+        App.manager.request_thumbnails(document.id, page_nos, THUMBNAIL_WIDTH,
+                                        self.thumbnailCacheDir(document))
+
+    def thumbnailCacheDir(self, document):
+        """ returns directory for thumbnails of a file, or empty str if
+        thumbnails are not saved on disk """
+        if not self.thumbnailDiskCacheAction.isChecked():
+            return ""
+        return os.path.join(THUMBNAIL_DIR, document.cacheKey())
+
+    def loadRenderCosts(self, document):
+        """ render times measured when the file was opened before """
+        try:
+            with open(os.path.join(RENDER_COST_DIR, document.cacheKey()+".json")) as f:
+                costs = json.load(f)
+            document.render_costs = {int(page_no):cost for page_no,cost in costs.items()}
+        except (OSError, ValueError):
+            pass
+
+    def saveRenderCosts(self, document):
+        if not document.render_costs:
+            return
+        try:
+            os.makedirs(RENDER_COST_DIR, exist_ok=True)
+            with open(os.path.join(RENDER_COST_DIR, document.cacheKey()+".json"), "w") as f:
+                json.dump(document.render_costs, f)
+        except OSError:
+            pass
+
+    def toggleThumbnailDiskCache(self, enable):
+        self.settings.setValue("ThumbnailDiskCache", enable)
+
+    def onThumbnailRendered(self, doc_id, page_no, image):
+        for document in App.documents:
+            if document.id==doc_id:
+                document.thumbnails[page_no] = image
+                if document is self.thumbnail_doc:
+                    self.thumbnailView.item(page_no-1).setIcon(QIcon(QPixmap.fromImage(image)))
+                self.trimThumbnails()
+                return
 
-        self.treeView.setModel(outline_model)
-        if root_item.rowCount() < 4:
-            self.treeView.expandToDepth(0)
-        self.treeView.setHeaderHidden(True)
-        self.treeView.header().setSectionResizeMode(0, QHeaderView.Stretch)
-        self.treeView.header().setSectionResizeMode(1, QHeaderView.ResizeToContents)
-        self.treeView.header().setStretchLastSection(False)
+    def trimThumbnails(self):
+        """ remove thumbnails until all fit in memory limit. thumbnails of other
+        documents are removed first, then those farthest from visible ones """
+        cache_size = sum(img.sizeInBytes() for doc in App.documents for img in doc.thumbnails.values())
+        if cache_size<=self.thumbnail_cache_limit:
+            return
+        viewport = self.thumbnailView.viewport()
+        first = max(self.thumbnailView.indexAt(QPoint(viewport.width()//2, 5)).row(), 0) + 1
+        for document in sorted(App.documents, key=lambda doc: doc is self.thumbnail_doc):
+            page_nos = sorted(document.thumbnails, key=lambda page_no: abs(page_no-first), reverse=True)
+            while cache_size>self.thumbnail_cache_limit and page_nos:
+                page_no = page_nos.pop(0)
+                cache_size -= document.thumbnails.pop(page_no).sizeInBytes()
+                if document is self.thumbnail_doc:
+                    self.thumbnailView.item(page_no-1).setIcon(self.blank_thumbnail)
+
+    def onThumbnailClick(self, item):
+        self.jumpToPage(self.thumbnailView.row(item)+1)
 
     def onOutlineClick(self, m_index):
         page_num = self.treeView.model().data(m_index, Qt.UserRole+1)
@@ -887,6 +2463,12 @@ class Window(QMainWindow, Ui_window):
         if not page_num: return
         self.jumpToPage(page_num, top)
 
+    def onOutlineHover(self, m_index):
+        """ render target page in advance, so that it is shown immediately on click """
+        page_num = self.treeView.model().data(m_index, Qt.UserRole+1)
+        if page_num and 0 < page_num <= self.pages_count:
+            App.manager.prefetch_page(page_num)
+
     def showStatus(self, text):
         if not text:
             self.statusbar.hide()
@@ -908,42 +2490,92 @@ class Window(QMainWindow, Ui_window):
         QMainWindow.resizeEvent(self, ev)
         # prevents page resize trigger on program startup
         # also handles both enter and exiting presentation mode
-        if not self.first_file_opened or self.presentation_mode:
+        if not App.document or self.presentation_mode:
             return
         self.resize_page_timer.start(200)
 
     def onWindowResize(self):
         if self.zoomLevelCombo.currentIndex() == 0:
-            App.manager.clear_cache()# remove old rendered images
+            old_dpis, old_display_dpis = App.page_dpis.copy(), App.document.display_dpis.copy()
             self.calculatePageDpis()
-            self.resizePages()
-            self.jumpToPage(self.curr_page_no)
+            # rendered images are still usable if render dpi is unchanged
+            if App.page_dpis != old_dpis:
+                App.manager.clear_cache()# remove old rendered images
+            if App.document.display_dpis != old_display_dpis:
+                self.resizePages()
+                self.jumpToPage(self.curr_page_no)
         if not self.isMaximized():
             self.settings.setValue("WindowWidth", self.width())
             self.settings.setValue("WindowHeight", self.height())
 
-    def updateFileHistory(self):
-        if not App.filename:
-            return
-        filename = collapseUser(App.filename)
+    def updateFileHistory(self, document):
+        filename = collapseUser(document.filename)
         if filename in self.file_history:
             self.file_history.pop(filename)# remove so that new entry adds to the end
-        self.file_history[filename] = self.curr_page_no
+        self.file_history[filename] = document.curr_page_no
+
+
+    def searchLibrary(self):
+        if not self.library_dialog:
+            self.library_dialog = LibrarySearchDialog(LIBRARY_INDEX_DIR, self.library_folders, self)
+            self.library_dialog.hitActivated.connect(self.openLibraryHit)
+        self.library_dialog.show()
+        self.library_dialog.raise_()
+        self.library_dialog.activateWindow()
+        # files may be added or modified since last update
+        if not self.library_dialog.indexer.isRunning():
+            self.library_dialog.updateIndex()
+
+    def openLibraryHit(self, filename, page_no, query):
+        """ opens the file, and highlights first search word in the page """
+        self.loadPDFfile(filename)
+        if not (App.document and App.filename==filename):
+            return
+        self.jumpToPage(page_no)
+        words = query.replace("*", " ").split()
+        if words:
+            self.dockSearch.show()
+            self.findTextEdit.setText(words[0])
+            self.search_text = ''# so that search starts from this page
+            self.findText(words[0], 1)
+
+    def eventFilter(self, obj, ev):
+        if ev.type() in (QEvent.KeyPress, QEvent.MouseButtonPress, QEvent.MouseMove, QEvent.Wheel):
+            self.idle_timer.start()
+            App.manager.set_idle(False)
+        return False
+
+    def onIdle(self):
+        if not App.manager.reclaim_memory():
+            self.idle_timer.start()# try again when workers are free
+            return
+        debug("Idle : memory reclaimed")
 
+    def showWorkerFailures(self):
+        manager = App.manager
+        lines = ["%s jobs : %i" % (kind.capitalize(), count) for kind,count in sorted(manager.failures.items())]
+        lines.append("Workers restarted : %i" % manager.recycled_count)
+        lines.append("Job timeout : %i sec" % manager.job_timeout)
+        QMessageBox.information(self, "Worker Failures", "\n".join(lines))
 
     def showAbout(self):
         lines = ("<h1>PDF Bunny</h1>",
             "A Fast Simple Pdf Viewer using PyMupdf or Poppler<br><br>",
             "Version : %s<br>" % __version__,
             "Qt : %s<br>" % qVersion(),
-            "%s : %s<br>" % (backend, backend_version),
+            "".join("%s : %s<br>" % (name, version) for name,version in backend_versions.items()),
             "Copyright &copy; %s %s &lt;%s&gt;" % (COPYRIGHT_YEAR, AUTHOR_NAME, AUTHOR_EMAIL))
         QMessageBox.about(self, "About PDF Bunny", "".join(lines))
 
     def closeEvent(self, ev):
         """ Save all settings on window close """
         self.settings.setValue("WindowMaximized", self.isMaximized())
-        self.updateFileHistory()
+        self.saveDocumentState()
+        # current document is added last, so that it becomes the most recent file
+        for document in sorted(App.documents, key=lambda doc: doc is App.document):
+            self.updateFileHistory(document)
+            self.saveRenderCosts(document)
+        pruneCacheDir(RENDER_COST_DIR)
         self.settings.setValue("ZoomLevel", self.zoomLevelCombo.currentIndex())
         self.settings.beginWriteArray("FileHistory")
         for i,filename in enumerate( list(self.file_history.keys())[-100:] ):
@@ -951,9 +2583,30 @@ class Window(QMainWindow, Ui_window):
             self.settings.setValue("Filename", filename)
             self.settings.setValue("PageNo", self.file_history[filename])
         self.settings.endArray()
+        self.settings.beginWriteArray("FileBackends")
+        for i,filename in enumerate( list(self.file_backends.keys())[-100:] ):
+            self.settings.setArrayIndex(i)
+            self.settings.setValue("Filename", filename)
+            self.settings.setValue("Backend", self.file_backends[filename])
+        self.settings.endArray()
+        self.settings.beginWriteArray("MeasuredBackends")
+        for i,filename in enumerate( list(self.measured_backends.keys())[-100:] ):
+            self.settings.setArrayIndex(i)
+            self.settings.setValue("Filename", filename)
+            self.settings.setValue("Backend", self.measured_backends[filename])
+        self.settings.endArray()
+        if self.library_dialog:
+            self.library_folders = self.library_dialog.folders
+        self.settings.beginWriteArray("LibraryFolders")
+        for i,folder in enumerate(self.library_folders):
+            self.settings.setArrayIndex(i)
+            self.settings.setValue("Folder", folder)
+        self.settings.endArray()
         return QMainWindow.closeEvent(self, ev)
 
     def onAppQuit(self):
+        if self.library_dialog:
+            self.library_dialog.indexer.stop()
         App.manager.close_threads()
 
 
@@ -985,56 +2638,120 @@ class Frame(QWidget):
         self.hScrollbar.setValue(self.h_scrollbar_pos + self.click_pos.x() - ev.globalX())
 
 
-class PageWidget(QLabel):
-    """ This widget shows a rendered page """
+class PageWidget(QWidget):
+    """ This widget shows a rendered page. Link, search and selection highlights
+    are drawn over the page image while painting, so the image is never modified.
+    The image is in RGB32 or ARGB32_Premultiplied format, which is painted
+    without conversion, or in Grayscale8 format to save memory """
+    link_color = QColor(0,0,127, 40)
+    highlight_color = QColor(0,255,0, 127)
+    selection_color = QColor(0,120,215, 80)
+
     def __init__(self, page_num, parent):
-        QLabel.__init__(self, parent)
+        QWidget.__init__(self, parent)
         self.setMouseTracking(True)
         self.setSizePolicy(0,0)#fixed
         self.link_annots = [] # list of (QRectF area, LinkAnnotation) tuple
         self.click_point, self.highlight_area = None, None
+        self.drag_point = None # current mouse pos while selecting in copy text mode
+        self.selection_area = None # recently copied words
         self.page_num = page_num
-        self.image = QPixmap()
+        self.image = QImage()
         self.dpi = 72# dpi is set when pages are resized
-
-    def setImage(self, image, links=[]):
-        self.image = image
-        self.updateImage()
+        self.links = []
+        self.error = "" # shown when page could not be rendered
+
+    def setDpi(self, dpi):
+        """ set dpi at which the page is shown. image may have been rendered
+        at a different dpi, in that case it is scaled while painting """
+        self.dpi = dpi
+        self.setLinks(self.links)
+
+    def setLinks(self, links):
+        self.links = links
+        self.link_annots = []
         for link in links:
             subtype,rect,data = link
             x,y,w,h = [x*self.dpi/72 for x in rect]
             self.link_annots.append((QRectF(x,y, w+1, h+1), link))
 
+    def setImage(self, image, links=[]):
+        self.image = image
+        self.error = ""
+        self.setLinks(links)
+        self.update()
+
     def updateImage(self):
         """ repaint page widget, and draw highlight areas """
-        if self.highlight_area:
-            img = self.image.copy()
-            painter = QPainter(img)
-            zoom = self.dpi/72.0
-            for area in self.highlight_area:
-                rect = [x*zoom for x in area]
-                painter.fillRect(QRectF(*rect), QColor(0,255,0, 127))
-            painter.end()
-            self.setPixmap(img)
-        else:
-            self.setPixmap(self.image)
+        self.update()
+
+    def showError(self, error):
+        self.error = error
+        self.update()
 
     def clear(self):
-        QLabel.clear(self)
-        self.image = QPixmap()
+        self.image = QImage()
+        self.error = ""
+        self.links = []
         self.link_annots.clear()
+        self.update()
+
+    def showSelection(self, areas):
+        """ highlight areas (in points) for a while """
+        self.selection_area = areas
+        self.update()
+        QTimer.singleShot(1000, self.clearSelection)
+
+    def clearSelection(self):
+        self.selection_area = None
+        self.update()
+
+    def selectionRect(self):
+        """ returns the rectangle being drawn in copy text mode """
+        if not (self.click_point and self.drag_point):
+            return QRectF()
+        return QRectF(self.click_point, self.drag_point).normalized()
+
+    def paintEvent(self, ev):
+        if self.image.isNull():
+            if self.error:
+                painter = QPainter(self)
+                painter.drawText(self.rect(), Qt.AlignCenter | Qt.TextWordWrap,
+                            "Failed to render page %i\n%s" % (self.page_num, self.error))
+                painter.end()
+            return
+        painter = QPainter(self)
+        if self.image.size()==self.size():
+            painter.drawImage(0, 0, self.image)
+        else:# rendered at a dpi bucket
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            painter.drawImage(QRectF(self.rect()), self.image)
+        # Add Heighlight over Link Annotation
+        for rect, link in self.link_annots:
+            painter.fillRect(rect, self.link_color)
+        zoom = self.dpi/72.0
+        if self.highlight_area:
+            for area in self.highlight_area:
+                rect = [x*zoom for x in area]
+                painter.fillRect(QRectF(*rect), self.highlight_color)
+        if self.selection_area:
+            for area in self.selection_area:
+                rect = [x*zoom for x in area]
+                painter.fillRect(QRectF(*rect), self.selection_color)
+        if self.drag_point:
+            painter.drawRect(self.selectionRect())
+        painter.end()
 
 
     def mouseMoveEvent(self, ev):
         # Draw rectangle when mouse is clicked and dragged in copy text mode.
         if App.window.copy_text_mode:
             if self.click_point:
-                pm = self.pm.copy()
-                painter = QPainter()
-                painter.begin(pm)
-                painter.drawRect(QRectF(self.click_point, ev.pos()))
-                painter.end()
-                self.setPixmap(pm)
+                # repaint only the area covered by old and new rectangle
+                dirty_rect = self.selectionRect()
+                self.drag_point = ev.pos()
+                dirty_rect = dirty_rect.united(self.selectionRect())
+                self.update(dirty_rect.toAlignedRect().adjusted(-1,-1,2,2))
             return
 
         # Change cursor if cursor is over link annotation
@@ -1045,6 +2762,7 @@ class PageWidget(QLabel):
                 if subtype == "GoTo":
                     App.window.showStatus("Jump To Page : %i" % data[0])
                     self.setCursor(Qt.PointingHandCursor)
+                    App.manager.prefetch_page(data[0])
                 # For URL link
                 elif subtype == "URI":
                     App.window.showStatus("URL : %s" % data)
@@ -1058,7 +2776,7 @@ class PageWidget(QLabel):
         # In text copy mode
         if App.window.copy_text_mode:
             self.click_point = ev.pos()
-            self.pm = self.pixmap().copy()
+            self.drag_point = None
             return
         # In normal mode
         for rect, link in self.link_annots:
@@ -1078,18 +2796,196 @@ class PageWidget(QLabel):
             return
         ev.ignore()
 
+    def mouseDoubleClickEvent(self, ev):
+        """ double click copies a word, and Ctrl + double click copies whole line """
+        if App.window.presentation_mode:
+            return ev.ignore()
+        App.window.copyWordAt(self.page_num, ev.pos(), bool(ev.modifiers() & Qt.ControlModifier))
+
     def mouseReleaseEvent(self, ev):
-        if App.window.copy_text_mode:
-            rect = QRectF(self.click_point, ev.pos()).getRect()
+        if App.window.copy_text_mode and self.click_point:
+            rect = QRectF(self.click_point, ev.pos()).normalized().getRect()
             App.window.copyText(self.page_num, list(rect))
-            self.setPixmap(self.pm)
-            self.click_point = None
-            self.pm = None
+            self.click_point, self.drag_point = None, None
+            self.update()
             return
         ev.ignore()
 
 
 
+class EncryptionJob(QObject):
+    """ Saves an encrypted copy of a pdf file if password is given, otherwise
+    saves a decrypted copy, without blocking gui. Uses qpdf if it is installed,
+    otherwise a backend having "encrypt" capability in a separate thread """
+    progressChanged = pyqtSignal(int)# percent
+    fallbackStarted = pyqtSignal(str)# error of qpdf, when saving in thread instead
+    finished = pyqtSignal(bool, str)# success, error message
+    threadFinished = pyqtSignal(bool)
+
+    def __init__(self, parent, filename, new_filename, password, decrypt):
+        QObject.__init__(self, parent)
+        self.filename = filename
+        self.new_filename = new_filename
+        self.password = password
+        self.decrypt = decrypt
+        self.process = None
+        self.cancelled = False
+        self.error = ""
+        self.threadFinished.connect(self.onFinished)
+
+    @staticmethod
+    def isAvailable():
+        return bool(which("qpdf") or backendWithCapability("encrypt"))
+
+    def start(self):
+        if which("qpdf"):
+            if self.decrypt:
+                args = ["--decrypt", "--password="+self.password]
+            else:
+                args = ["--encrypt", self.password, self.password, "128", "--"]
+            self.process = QProcess(self)
+            self.process.readyReadStandardOutput.connect(self.onProcessOutput)
+            self.process.finished.connect(self.onProcessFinished)
+            self.process.errorOccurred.connect(self.onProcessError)
+            self.process.start("qpdf", ["--progress"] + args + [self.filename, self.new_filename])
+            return
+        self.startThread()
+
+    def startThread(self):
+        if not backendWithCapability("encrypt"):
+            self.threadFinished.emit(False)
+            return
+        # this thread does not use any Qt object, so python thread is enough
+        threading.Thread(target=self.saveInThread, daemon=True).start()
+
+    def saveInThread(self):
+        success = False
+        try:
+            doc = PdfDocument(self.filename, backendWithCapability("encrypt"))
+            if doc.isLocked():
+                doc.unlock(self.password)
+            if self.decrypt:
+                doc.saveDecrypted(self.new_filename)
+            else:
+                doc.saveEncrypted(self.new_filename, self.password)
+            success = True
+        except:
+            pass
+        self.threadFinished.emit(success)
+
+    def onProcessOutput(self):
+        # qpdf prints lines like "qpdf: file.pdf: write progress: 50%"
+        output = bytes(self.process.readAllStandardOutput()).decode(errors="ignore")
+        percents = re.findall(r"(\d+)%", output)
+        if percents:
+            self.progressChanged.emit(int(percents[-1]))
+
+    def onProcessError(self, error):
+        """ finished is not emitted if qpdf could not be started """
+        if error!=QProcess.FailedToStart:
+            return
+        self.error = "qpdf failed to start : " + self.process.errorString()
+        self.process = None
+        if self.cancelled or not backendWithCapability("encrypt"):
+            self.onFinished(False)
+            return
+        self.fallbackStarted.emit(self.error)
+        self.startThread()
+
+    def onProcessFinished(self, exit_code, exit_status):
+        self.onFinished(exit_status==QProcess.NormalExit and exit_code==0)
+
+    def cancel(self):
+        """ qpdf is killed. Saving in thread can not be stopped, so the file
+        is removed after it is saved """
+        self.cancelled = True
+        if self.process:
+            self.process.kill()
+
+    def onFinished(self, success):
+        if self.cancelled:
+            if os.path.exists(self.new_filename):
+                os.remove(self.new_filename)
+            success = False
+        self.finished.emit(success, "" if success else self.error)
+        self.deleteLater()
+
+
+
+class InstanceServer(QLocalServer):
+    """ Listens for filenames sent by new invocations of the program """
+    fileReceived = pyqtSignal(str)
+
+    def __init__(self, parent):
+        QLocalServer.__init__(self, parent)
+        self.setSocketOptions(QLocalServer.UserAccessOption)
+        self.error_message = ""
+        self.newConnection.connect(self.onNewConnection)
+
+    def start(self):
+        """ returns False if another instance is already listening, or the
+        socket can not be created. error_message tells the reason """
+        # connecting is tried first, as listen() with socket options replaces
+        # existing socket file
+        socket = QLocalSocket()
+        socket.connectToServer(SERVER_NAME)
+        if socket.waitForConnected(500):
+            if isOwnServer(socket):
+                # empty filename, so that the running instance closes the connection
+                socket.write(b"\n")
+                socket.waitForBytesWritten(1000)
+            socket.disconnectFromServer()
+            self.error_message = "Another instance is already running"
+            return False
+        # socket file of a crashed instance is left behind
+        QLocalServer.removeServer(SERVER_NAME)
+        if not self.listen(SERVER_NAME):
+            self.error_message = self.errorString()
+            return False
+        return True
+
+    def onNewConnection(self):
+        socket = self.nextPendingConnection()
+        socket.received = b""
+        socket.readyRead.connect(lambda: self.onReadyRead(socket))
+
+    def onReadyRead(self, socket):
+        socket.received += bytes(socket.readAll())
+        # filename is terminated by newline
+        if not socket.received.endswith(b"\n"):
+            return
+        filename = socket.received.decode("utf-8").strip()
+        socket.disconnectFromServer()
+        socket.deleteLater()
+        if filename:
+            self.fileReceived.emit(filename)
+
+
+def sendToRunningInstance(filename):
+    """ passes filename to already running instance. returns True on success """
+    socket = QLocalSocket()
+    socket.connectToServer(SERVER_NAME)
+    if not socket.waitForConnected(500):
+        return False
+    if not isOwnServer(socket):
+        socket.disconnectFromServer()
+        return False
+    socket.write((filename + "\n").encode("utf-8"))
+    ok = socket.waitForBytesWritten(1000)
+    socket.disconnectFromServer()
+    return ok
+
+def isOwnServer(socket):
+    """ whether the connected server socket is created by this user. another
+    user may create a socket of same name in shared /tmp """
+    if not hasattr(os, "getuid"):
+        return True
+    try:
+        return os.stat(socket.fullServerName()).st_uid==os.getuid()
+    except OSError:
+        return False
+
+
 class Notifier(QSystemTrayIcon):
     def __init__(self, parent):
         QSystemTrayIcon.__init__(self, QIcon(':/icons/pdf-bunny.png'), parent)
@@ -1110,21 +3006,72 @@ def wait(millisec):
     QTimer.singleShot(millisec, loop.quit)
     loop.exec_()
 
+def dpiBucket(dpi, step):
+    """ returns the smallest dpi of the form 72*(1+step/100)^n which is not
+    less than dpi. step is in percent """
+    if step<=0 or dpi<=0:
+        return int(dpi)
+    ratio = 1+step/100
+    bucket = lambda n : math.ceil(round(72*ratio**n, 6))
+    n = math.ceil(math.log(dpi/72, ratio))
+    return bucket(n-1) if bucket(n-1)>=dpi else bucket(n)
+
+def releaseFreeMemory():
+    """ returns freed heap memory to the OS. only glibc needs it """
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+def isDraft(image):
+    """ whether image is a low quality render made while scrolling fast """
+    return image.text("draft")=="1"
+
 def collapseUser(path):
     ''' converts /home/user/file.ext to ~/file.ext '''
     if path.startswith(HOMEDIR):
         return path.replace(HOMEDIR, '~', 1)
     return path
 
+def pruneCacheDir(cache_dir, max_age=30):
+    """ remove cached data of files which were not opened for max_age days """
+    if not os.path.isdir(cache_dir):
+        return
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if time.time() - os.path.getmtime(path) > max_age*24*3600:
+            if os.path.isdir(path):
+                rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
 def elideMiddle(text, length):
     if len(text) <= length: return text
     return text[:length//2] + '...' + text[len(text)-length+length//2:]
 
 def main():
+    # pool processes of library indexer run this program in frozen build
+    freeze_support()
+    if len(sys.argv)>1 and sys.argv[1]=="--update-library-index":
+        import library_index
+        library_index.main(sys.argv[2:])
+        return
     app = QApplication(sys.argv)
-    filename = os.path.abspath(sys.argv[-1])
+    args = sys.argv[1:]
+    # session is recorded for measuring latency with session_replay.py
+    session_file = None
+    if len(args)>1 and args[0]=="--record-session":
+        session_file, args = args[1], args[2:]
+    filename = os.path.abspath(args[-1]) if args else ''
+    if args and os.path.exists(filename):
+        settings = QSettings("pdf-bunny", "main")
+        if settings.value("SingleInstance", "false")=="true" and sendToRunningInstance(filename):
+            return
     win = Window()
-    if len(sys.argv)>1 and os.path.exists(filename):
+    if session_file:
+        from session_replay import SessionRecorder
+        win.session_recorder = SessionRecorder(win, session_file)
+    if args and os.path.exists(filename):
         win.loadPDFfile(filename)
     app.aboutToQuit.connect(win.onAppQuit)
     sys.exit(app.exec_())
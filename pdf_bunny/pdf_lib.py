@@ -1,224 +1,512 @@
 # -*- coding: utf-8 -*-
-from PyQt5.QtCore import QRectF
+import time
+import hashlib
+from array import array
+from collections import OrderedDict
+from bisect import bisect_right
+
+from PyQt5.QtCore import QRectF, QByteArray
 from PyQt5.QtGui import QImage
 
 
+backend_classes = {} # {name : PdfDocument subclass} of imported backends
+backend_versions = {} # {name : version str} of imported backends
+failed_backends = set()
+
 def import_fitz():
-    global fitz, backend_version
+    global fitz
     import fitz
-    backend_version = fitz.version[0]
+    backend_classes["fitz"] = FitzDocument
+    backend_versions["fitz"] = fitz.version[0]
 
 def import_poppler():
-    global Poppler, backend_version
+    global Poppler
     from popplerqt5 import Poppler, poppler_version
-    backend_version = "%i.%i.%i" % poppler_version()
+    backend_classes["poppler"] = PopplerDocument
+    backend_versions["poppler"] = "%i.%i.%i" % poppler_version()
 
+# in order of preference. first available one is the default backend.
+# other backends are imported only when they are required.
 #backends = [("fitz", import_fitz), ("poppler", import_poppler), ]
 backends = [("poppler", import_poppler), ("fitz", import_fitz), ]
 
-for backend, import_func in backends:
+
+def registerBackend(name, import_func):
+    """ Add a new backend. import_func must import the library and add
+    the PdfDocument subclass to backend_classes dict """
+    backends.append((name, import_func))
+
+def loadBackend(name):
+    """ imports backend if not imported yet. returns True if it is available """
+    if name in backend_classes:
+        return True
+    if name in failed_backends:
+        return False
+    for backend_name, import_func in backends:
+        if backend_name==name:
+            try:
+                import_func()
+                return True
+            except:
+                failed_backends.add(name)
+    return False
+
+def availableBackends():
+    """ returns names of all available backends """
+    return [name for name,import_func in backends if loadBackend(name)]
+
+
+def readFile(filename):
+    """ returns content of file as bytes, or None if it can not be read """
     try:
-        import_func()
-        break
-    except : pass
+        with open(filename, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def backendWithCapability(capability):
+    """ returns name of first available backend having the capability, or None """
+    for name in availableBackends():
+        if capability in backend_classes[name].capabilities:
+            return name
+    return None
+
+def fastestBackend(filename, password='', data=None):
+    """ renders a sample page using each available backend, and
+    returns name of the backend which rendered fastest """
+    timings = {}
+    for name in availableBackends():
+        doc = PdfDocument(filename, name, data)
+        if not doc.isValid() or (doc.isLocked() and not doc.unlock(password)):
+            continue
+        page_no = doc.pageCount()//2 + 1
+        start = time.perf_counter()
+        doc.renderPage(page_no, 72)
+        timings[name] = time.perf_counter() - start
+    return min(timings, key=timings.get) if timings else backend
 
 
 
 class PdfDocument:
-    """ Wrapper class of pdf backend library """
-    def __init__(self, filename):
-        if backend=="poppler":
-            self.doc = Poppler.Document.load(filename)
-            if self.doc:
-                self.doc.setRenderHint(Poppler.Document.TextAntialiasing | Poppler.Document.TextHinting |
-                         Poppler.Document.Antialiasing | Poppler.Document.ThinLineSolid )
-
-        elif backend=="fitz":
-            try:
-                self.doc = fitz.open(filename, filetype="pdf")
-            except:
-                self.doc = None
+    """ Wrapper class of pdf backend libraries. Each backend is a subclass.
+    PdfDocument(filename) opens the document using default backend,
+    PdfDocument(filename, name) opens using the given backend.
+    If data (file content) is given, document is opened from memory instead of
+    reading the file. doc.data can be used to open more documents from same buffer """
+    name = ""
+    data = None
+    # features that are not supported by all backends
+    # "gray_render" : can render in grayscale colorspace directly
+    # "encrypt" : can save encrypted or decrypted copy of document
+    capabilities = set()
+
+    def __new__(cls, filename, backend_name=None, data=None):
+        if cls is PdfDocument:
+            if not (backend_name and loadBackend(backend_name)):
+                backend_name = backend
+            cls = backend_classes[backend_name]
+        return object.__new__(cls)
 
     def isValid(self):
         return bool(self.doc)
 
     def isLocked(self):
         """ returns False after document is unlocked """
-        if backend=="poppler":
-            return self.doc.isLocked()
-        elif backend=="fitz":
-            return self.doc.is_encrypted
+        raise NotImplementedError
 
     def unlock(self, password):
         """ Unlock a password protected PDF. returns True on success """
-        if backend=="poppler":
-            locked = self.doc.unlock(password.encode(), password.encode())
-            self.doc.setRenderHint(Poppler.Document.TextAntialiasing | Poppler.Document.TextHinting |
-                         Poppler.Document.Antialiasing | Poppler.Document.ThinLineSolid )
-            return not locked
-
-        elif backend=="fitz":
-            return self.doc.authenticate(password)# returns 1,2,4 or 6 if successful
+        raise NotImplementedError
 
     def pageCount(self):
-        if backend=="poppler":
-            return self.doc.numPages()
-        elif backend=="fitz":
-            return len(self.doc)# or self.doc.page_count
+        raise NotImplementedError
 
     def hasEmbeddedFiles(self):
-        if backend=="poppler":
-            return self.doc.hasEmbeddedFiles()
-        elif backend=="fitz":
-            return self.doc.embfile_count()
+        raise NotImplementedError
 
     def info(self):
         """ returns document info as dict """
-        if backend=="poppler":
-            return {key:self.doc.info(key) for key in self.doc.infoKeys()}
-        elif backend=="fitz":
-            metadata = self.doc.metadata or {}
-            return {key:val for key,val in metadata.items() if val}
+        raise NotImplementedError
 
     def toc(self):
         """ returns list of lists. each entry is in [level, title, page_no, top]
          format. level starts from 1. top has value in point """
+        raise NotImplementedError
+
+    def pageSize(self, page_no):
+        """ returns page (width,height) in points """
+        raise NotImplementedError
+
+    def renderPage(self, page_no, dpi, color_mode="color", draft=False):
+        """ @int page_no, @int dpi (mupdf only accepts int as dpi val)
+        @str color_mode : "color", "gray" or "auto" (gray if page has no colors)
+        @bool draft : render faster in low quality at half dpi
+        returns QImage in RGB32 or ARGB32_Premultiplied format, which are
+        native formats of screen and can be drawn without conversion.
+        Grayscale pages are returned in Grayscale8 format which needs
+        one fourth memory """
+        if draft:
+            dpi = max(dpi//2, 1)
+        img = self.renderImage(page_no, dpi, color_mode=="gray", draft)
+        if img and img.format()!=QImage.Format_Grayscale8 and (color_mode=="gray" or
+                        (color_mode=="auto" and img.allGray())):
+            img = img.convertToFormat(QImage.Format_Grayscale8)
+        return img
+
+    def renderImage(self, page_no, dpi, gray=False, draft=False):
+        """ returns QImage in RGB32, ARGB32_Premultiplied or (if gray is True
+        and backend has gray_render capability) Grayscale8 format.
+        if draft is True, antialiasing is turned off where the backend allows """
+        raise NotImplementedError
+
+    def pageLinkAnnotations(self, page_no):
+        """ returns list of annotations. Each annot is in [type, rect, target] format.
+        If type is 'GoTo', target is (page_no,top) tuple.
+        If type is URI, target is url str """
+        raise NotImplementedError
+
+    def getPageText(self, page_no, rect):
+        """ rect must be in [x,y,w,h] format with vals in points. returns text str """
+        raise NotImplementedError
+
+    def textLayer(self, page_no):
+        """ returns TextLayer containing all words of the page """
+        raise NotImplementedError
+
+    def findText(self, page_no, text):
+        """ returns a list of rects """
+        raise NotImplementedError
+
+    def saveEncrypted(self, filename, password):
+        """ saves a copy encrypted with password. requires "encrypt" capability """
+        raise NotImplementedError
+
+    def saveDecrypted(self, filename):
+        """ saves a copy without encryption. requires "encrypt" capability """
+        raise NotImplementedError
+
+    def clearCaches(self):
+        """ frees parsed pages of this document, these are loaded again when required """
+        pass
+
+    @staticmethod
+    def shrinkStore():
+        """ empties resource cache shared by all documents of the backend.
+        does nothing if backend has no such cache """
+        pass
+
+    def pageFingerprint(self, page_no):
+        """ returns a hash str which changes when page content is changed.
+        This hashes a low resolution render, backends may do it faster.
+        Small text edits may not change the render, so text is hashed too """
+        fingerprint = hashlib.md5(repr((self.pageSize(page_no),
+                        self.pageLinkAnnotations(page_no))).encode())
+        img = self.renderImage(page_no, 18, True)
+        fingerprint.update(img.constBits().asstring(img.sizeInBytes()))
+        layer = self.textLayer(page_no)
+        fingerprint.update(repr((layer.words, layer.boxes.tobytes())).encode())
+        return fingerprint.hexdigest()
+
+
+
+class PageCache:
+    """ LRU cache of parsed pages of a document, so that rendering, links and
+    text of same page do not parse the page again. load(page_no) parses a page """
+    def __init__(self, load, max_size):
+        self.load = load
+        self.max_size = max_size
+        self.pages = OrderedDict()
+
+    def get(self, page_no):
+        if page_no in self.pages:
+            self.pages.move_to_end(page_no)
+            return self.pages[page_no]
+        page = self.load(page_no)
+        self.pages[page_no] = page
+        if len(self.pages)>self.max_size:
+            self.pages.popitem(last=False)
+        return page
+
+    def clear(self):
+        self.pages.clear()
+
+
+
+class PopplerDocument(PdfDocument):
+    name = "poppler"
+    draft = False # whether antialiasing is turned off
+
+    def __init__(self, filename, backend_name=None, data=None):
+        self.page_cache = PageCache(lambda page_no: self.doc.page(page_no-1), 16)
+        if data is None:
+            self.doc = Poppler.Document.load(filename)
+        else:
+            # QByteArray is implicitly shared, so other documents
+            # opened from self.data do not copy it
+            self.data = data if isinstance(data, QByteArray) else QByteArray(data)
+            self.doc = Poppler.Document.loadFromData(self.data)
+        if self.doc:
+            self.setRenderHints()
+
+    def setRenderHints(self, draft=False):
+        self.draft = draft
+        self.doc.setRenderHint(Poppler.Document.TextAntialiasing | Poppler.Document.TextHinting |
+                         Poppler.Document.Antialiasing, not draft)
+        self.doc.setRenderHint(Poppler.Document.ThinLineSolid)
+
+    def isLocked(self):
+        return self.doc.isLocked()
+
+    def unlock(self, password):
+        locked = self.doc.unlock(password.encode(), password.encode())
+        self.clearCaches()
+        self.setRenderHints(self.draft)
+        return not locked
+
+    def clearCaches(self):
+        self.page_cache.clear()
+
+    def pageCount(self):
+        return self.doc.numPages()
+
+    def hasEmbeddedFiles(self):
+        return self.doc.hasEmbeddedFiles()
+
+    def info(self):
+        return {key:self.doc.info(key) for key in self.doc.infoKeys()}
+
+    def toc(self):
         result = []
-        if backend=="poppler":
-            toc = self.doc.toc()
-            if not toc:
-                return []
-            stack = [(toc.firstChild(), 1)]
-            while stack:
-                node, level = stack.pop()
-                elm = node.toElement()
-
-                linkDestination = None
-                if elm.hasAttribute("Destination"):
-                    linkDestination = Poppler.LinkDestination(elm.attribute("Destination"))
-                elif elm.hasAttribute("DestinationName"):
-                    linkDestination = self.doc.linkDestination(elm.attribute("DestinationName"))
-
-                page_no, top = -1, 0.0
-
-                if linkDestination:
-                    # top may be not in range 0.0->1.0, we have to take care of that
-                    page_num = linkDestination.pageNumber()
-                    if 0 < page_num <= self.doc.numPages():
-                        page_no = page_num
-                        top = linkDestination.top() if linkDestination.isChangeTop() else 0
-                        top *= self.doc.page(page_num-1).pageSizeF().height()# convert to pt
-
-                result.append([level, elm.tagName(), page_no, top])
-
-                # Load next sibling
-                siblingNode = node.nextSibling()
-                if not siblingNode.isNull():
-                    stack.append((siblingNode,level))
-
-                # Load its child
-                childNode = node.firstChild()
-                if not childNode.isNull():
-                    stack.append((childNode,level+1))
-
-        elif backend=="fitz":
-            toc = self.doc.get_toc(simple=False)
-            for lvl,title,page_no,dest in toc:
-                top = dest["to"].y if dest["kind"]==fitz.LINK_GOTO else 0.0
-                result.append([lvl, title, page_no, top])
+        toc = self.doc.toc()
+        if not toc:
+            return []
+        stack = [(toc.firstChild(), 1)]
+        while stack:
+            node, level = stack.pop()
+            elm = node.toElement()
+
+            linkDestination = None
+            if elm.hasAttribute("Destination"):
+                linkDestination = Poppler.LinkDestination(elm.attribute("Destination"))
+            elif elm.hasAttribute("DestinationName"):
+                linkDestination = self.doc.linkDestination(elm.attribute("DestinationName"))
+
+            page_no, top = -1, 0.0
+
+            if linkDestination:
+                # top may be not in range 0.0->1.0, we have to take care of that
+                page_num = linkDestination.pageNumber()
+                if 0 < page_num <= self.doc.numPages():
+                    page_no = page_num
+                    top = linkDestination.top() if linkDestination.isChangeTop() else 0
+                    top *= self.page_cache.get(page_num).pageSizeF().height()# convert to pt
+
+            result.append([level, elm.tagName(), page_no, top])
+
+            # Load next sibling
+            siblingNode = node.nextSibling()
+            if not siblingNode.isNull():
+                stack.append((siblingNode,level))
+
+            # Load its child
+            childNode = node.firstChild()
+            if not childNode.isNull():
+                stack.append((childNode,level+1))
+        return result
+
+    def pageSize(self, page_no):
+        page_size = self.page_cache.get(page_no).pageSizeF()
+        return page_size.width(), page_size.height()
+
+    def renderImage(self, page_no, dpi, gray=False, draft=False):
+        page = self.page_cache.get(page_no)
+        if not page:
+            return None
+        if draft!=self.draft:
+            self.setRenderHints(draft)
+        img = page.renderToImage(dpi, dpi)
+        if img.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32_Premultiplied):
+            img = img.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        return img
 
+    def pageLinkAnnotations(self, page_no):
+        result = []
+        page = self.page_cache.get(page_no)
+        if not page:
+            return []
+        page_w, page_h = page.pageSizeF().width(), page.pageSizeF().height()
+        annots = page.annotations()
+        for annot in annots:
+            if annot.subType() == Poppler.Annotation.ALink:
+                dest = annot.linkDestination()
+                if not dest:
+                    continue
+                x, y = annot.boundary().left()*page_w, annot.boundary().top()*page_h
+                w, h = annot.boundary().width()*page_w, annot.boundary().height()*page_h
+                if dest.linkType() == Poppler.Link.Goto:
+                    page_num = dest.destination().pageNumber()
+                    # top has val from 0.0 to 1.0
+                    top = dest.destination().isChangeTop() and dest.destination().top() or 0.0
+                    result.append(["GoTo", (x,y,w,h), (page_num,top*page_h)])
+                elif dest.linkType() == Poppler.Link.Browse:
+                    url = dest.url()
+                    result.append(["URI", (x,y,w,h), url])
         return result
 
+    def getPageText(self, page_no, rect):
+        return self.page_cache.get(page_no).text(QRectF(*rect))
+
+    def textLayer(self, page_no):
+        words, boxes, line_nos = [], [], []
+        line_no, prev_box = -1, None
+        for textbox in self.page_cache.get(page_no).textList():
+            x1,y1,x2,y2 = textbox.boundingBox().getCoords()
+            # new line starts if word is not beside previous word
+            if not prev_box or x1<prev_box[0] or (y1+y2)/2>prev_box[3] or (y1+y2)/2<prev_box[1]:
+                line_no += 1
+            words.append(textbox.text())
+            boxes += (x1,y1,x2,y2)
+            line_nos.append(line_no)
+            prev_box = x1,y1,x2,y2
+        return TextLayer(words, boxes, line_nos)
 
-    def pageSize(self, page_no):
-        """ returns page (width,height) in points """
-        if backend=="poppler":
-            page_size = self.doc.page(page_no-1).pageSizeF()
-            return page_size.width(), page_size.height()
-        elif backend=="fitz":
-            rect  = self.doc[page_no-1].rect
-            return rect.width, rect.height
+    def findText(self, page_no, text):
+        page = self.page_cache.get(page_no)
+        rects = page.search(text,Poppler.Page.CaseInsensitive,0)
+        return [list(rect.getRect()) for rect in rects]
+
+
+
+class FitzDocument(PdfDocument):
+    name = "fitz"
+    capabilities = {"gray_render", "encrypt"}
+
+    def __init__(self, filename, backend_name=None, data=None):
+        self.page_cache = PageCache(lambda page_no: self.doc.load_page(page_no-1), 16)
+        # display list has all drawing commands of a page, so that page can be
+        # rendered at another dpi without interpreting the content again.
+        # fewer are kept, as these can be large for complex pages
+        self.display_lists = PageCache(lambda page_no: self.page_cache.get(page_no).get_displaylist(), 4)
+        try:
+            if data is None:
+                self.doc = fitz.open(filename, filetype="pdf")
+            else:
+                # mupdf uses the bytes object without copying
+                self.data = data if isinstance(data, bytes) else bytes(data)
+                self.doc = fitz.open(stream=self.data, filetype="pdf")
+        except:
+            self.doc = None
+
+    def isLocked(self):
+        return self.doc.is_encrypted
+
+    def unlock(self, password):
+        self.clearCaches()
+        return self.doc.authenticate(password)# returns 1,2,4 or 6 if successful
+
+    def clearCaches(self):
+        self.page_cache.clear()
+        self.display_lists.clear()
+
+    @staticmethod
+    def shrinkStore():
+        fitz.TOOLS.store_shrink(100)
+
+    def pageCount(self):
+        return len(self.doc)# or self.doc.page_count
+
+    def hasEmbeddedFiles(self):
+        return self.doc.embfile_count()
 
-    def renderPage(self, page_no, dpi):
-        """ @int page_no, @int dpi (mupdf only accepts int as dpi val)"""
-        if backend=="poppler":
-            page = self.doc.page(page_no-1)
-            if page:
-                return page.renderToImage(dpi, dpi)
+    def info(self):
+        metadata = self.doc.metadata or {}
+        return {key:val for key,val in metadata.items() if val}
 
-        elif backend=="fitz":
-            pix = self.doc.get_page_pixmap(page_no-1, dpi=int(dpi))
-            return QImage(pix.samples, pix.w, pix.h, pix.stride, QImage.Format_RGB888)
+    def toc(self):
+        result = []
+        toc = self.doc.get_toc(simple=False)
+        for lvl,title,page_no,dest in toc:
+            top = dest["to"].y if dest["kind"]==fitz.LINK_GOTO else 0.0
+            result.append([lvl, title, page_no, top])
+        return result
 
+    def pageSize(self, page_no):
+        rect  = self.page_cache.get(page_no).rect
+        return rect.width, rect.height
+
+    def renderImage(self, page_no, dpi, gray=False, draft=False):
+        # antialiasing level of mupdf is global to all documents and threads,
+        # so draft pages are rendered only at lower dpi
+        display_list = self.display_lists.get(page_no)
+        matrix = fitz.Matrix(int(dpi)/72, int(dpi)/72)
+        if gray:
+            pix = display_list.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+            img = QImage(pix.samples_mv, pix.w, pix.h, pix.stride, QImage.Format_Grayscale8)
+            return img.copy()# copy, so that image owns its data
+        pix = display_list.get_pixmap(matrix=matrix, alpha=False)
+        # QImage uses pixmap's buffer without copying, conversion creates
+        # a new image which owns its data, so pix can be freed safely
+        img = QImage(pix.samples_mv, pix.w, pix.h, pix.stride, QImage.Format_RGB888)
+        return img.convertToFormat(QImage.Format_RGB32)
 
     def pageLinkAnnotations(self, page_no):
-        """ returns list of annotations. Each annot is in [type, rect, target] format.
-        If type is 'GoTo', target is (page_no,top) tuple.
-        If type is URI, target is url str """
         result = []
-        if backend=="poppler":
-            page = self.doc.page(page_no-1)
-            page_w, page_h = page.pageSizeF().width(), page.pageSizeF().height()
-            if not page:
-                return []
-            annots = page.annotations()
-            for annot in annots:
-                if annot.subType() == Poppler.Annotation.ALink:
-                    dest = annot.linkDestination()
-                    if not dest:
-                        continue
-                    x, y = annot.boundary().left()*page_w, annot.boundary().top()*page_h
-                    w, h = annot.boundary().width()*page_w, annot.boundary().height()*page_h
-                    if dest.linkType() == Poppler.Link.Goto:
-                        page_num = dest.destination().pageNumber()
-                        # top has val from 0.0 to 1.0
-                        top = dest.destination().isChangeTop() and dest.destination().top() or 0.0
-                        result.append(["GoTo", (x,y,w,h), (page_num,top*page_h)])
-                    elif dest.linkType() == Poppler.Link.Browse:
-                        url = dest.url()
-                        result.append(["URI", (x,y,w,h), url])
-
-        elif backend=="fitz":
-            page = self.doc.load_page(page_no-1)
-            page_rect = page.rect
-            if not page:
-                return []
-            links = page.get_links()
-            for link in links:
-                rect = link["from"]
-                x, y, w, h = rect.x0-page_rect.x0, rect.y0-page_rect.y0, rect.width, rect.height
-                if link["kind"]==fitz.LINK_URI:
-                    result.append(["URI", [x,y,w,h], link["uri"]])
-                elif link["kind"]==fitz.LINK_GOTO:
-                    top = link["to"].y
-                    result.append(["GoTo", [x,y,w,h], (link["page"]+1,top)])
-                elif link["kind"]==fitz.LINK_NAMED:
-                    page_no = parse_named_dest(link["name"])
-                    if page_no>0:
-                        result.append(["GoTo", [x,y,w,h], (page_no,0)])
-                    #print(link["name"])
+        page = self.page_cache.get(page_no)
+        page_rect = page.rect
+        if not page:
+            return []
+        links = page.get_links()
+        for link in links:
+            rect = link["from"]
+            x, y, w, h = rect.x0-page_rect.x0, rect.y0-page_rect.y0, rect.width, rect.height
+            if link["kind"]==fitz.LINK_URI:
+                result.append(["URI", [x,y,w,h], link["uri"]])
+            elif link["kind"]==fitz.LINK_GOTO:
+                top = link["to"].y
+                result.append(["GoTo", [x,y,w,h], (link["page"]+1,top)])
+            elif link["kind"]==fitz.LINK_NAMED:
+                page_no = parse_named_dest(link["name"])
+                if page_no>0:
+                    result.append(["GoTo", [x,y,w,h], (page_no,0)])
+                #print(link["name"])
         return result
 
     def getPageText(self, page_no, rect):
-        """ rect must be in [x,y,w,h] format with vals in points. returns text str """
-        if backend=="poppler":
-            return self.doc.page(page_no-1).text(QRectF(*rect))
-
-        elif backend=="fitz":
-            #see https://github.com/pymupdf/PyMuPDF-Utilities/tree/master/textbox-extraction
-            page = self.doc.load_page(page_no-1)
-            x,y,w,h = rect
-            return page.get_textbox(fitz.Rect(x,y,x+w,y+h))
+        #see https://github.com/pymupdf/PyMuPDF-Utilities/tree/master/textbox-extraction
+        page = self.page_cache.get(page_no)
+        x,y,w,h = rect
+        return page.get_textbox(fitz.Rect(x,y,x+w,y+h))
+
+    def textLayer(self, page_no):
+        words, boxes, line_nos = [], [], []
+        page = self.page_cache.get(page_no)
+        lines = {}
+        for x1,y1,x2,y2,word,block_no,line_no,word_no in page.get_text("words"):
+            words.append(word)
+            boxes += (x1,y1,x2,y2)
+            line_nos.append(lines.setdefault((block_no,line_no), len(lines)))
+        return TextLayer(words, boxes, line_nos)
 
     def findText(self, page_no, text):
-        """ returns a list of rects """
-        if backend=="poppler":
-            page = self.doc.page(page_no-1)
-            rects = page.search(text,Poppler.Page.CaseInsensitive,0)
-            return [list(rect.getRect()) for rect in rects]
-        elif backend=="fitz":
-            rects = self.doc.search_page_for(page_no-1, text)
-            return [[rect.x0,rect.y0,rect.width,rect.height] for rect in rects ]
+        rects = self.page_cache.get(page_no).search_for(text)
+        return [[rect.x0,rect.y0,rect.width,rect.height] for rect in rects ]
+
+    def saveEncrypted(self, filename, password):
+        self.doc.save(filename, encryption=fitz.PDF_ENCRYPT_AES_128,
+                        owner_pw=password, user_pw=password)
+
+    def saveDecrypted(self, filename):
+        self.doc.save(filename, encryption=fitz.PDF_ENCRYPT_NONE)
+
+    def pageFingerprint(self, page_no):
+        page = self.page_cache.get(page_no)
+        fingerprint = hashlib.md5(repr((tuple(page.rect), page.rotation,
+                        self.pageLinkAnnotations(page_no))).encode())
+        fingerprint.update(page.read_contents())
+        # content stream only contains names of images and forms, not their data
+        for xref in [img[0] for img in page.get_images()] + [x[0] for x in page.get_xobjects()]:
+            fingerprint.update(self.doc.xref_stream_raw(xref) or b'')
+        return fingerprint.hexdigest()
 
 
 # text is like 'page=645&zoom=100,-5,338' or page=95&view=Fit
@@ -234,3 +522,108 @@ def parse_named_dest(text):
             break
         page_no += ch
     return int(page_no)
+
+
+class TextLayer:
+    """ Words of a page and their bounding boxes (in points), stored in compact
+    arrays. It is extracted once per page, then used for copying, selection
+    and searching text without calling the backend again """
+    def __init__(self, words, boxes, line_nos):
+        self.words = words
+        self.boxes = array("d", boxes)# x1,y1,x2,y2 of each word
+        self.line_nos = array("i", line_nos)
+        # position of each word in self.text
+        self.offsets = array("i")
+        text = []
+        pos = 0
+        for i,word in enumerate(words):
+            if i>0:
+                text.append(" " if line_nos[i]==line_nos[i-1] else "\n")
+                pos += 1
+            self.offsets.append(pos)
+            text.append(word)
+            pos += len(word)
+        self.text = "".join(text)
+
+    def wordBox(self, index):
+        return tuple(self.boxes[4*index:4*index+4])
+
+    def wordAt(self, x, y):
+        """ returns index of word at point x,y or -1 """
+        for i in range(len(self.words)):
+            x1,y1,x2,y2 = self.wordBox(i)
+            if x1<=x<=x2 and y1<=y<=y2:
+                return i
+        return -1
+
+    def lineWords(self, line_no):
+        """ returns indexes of words in the line """
+        return [i for i,n in enumerate(self.line_nos) if n==line_no]
+
+    def wordsInRect(self, rect):
+        """ returns indexes of words whose center is inside rect [x,y,w,h] """
+        x,y,w,h = rect
+        result = []
+        for i in range(len(self.words)):
+            x1,y1,x2,y2 = self.wordBox(i)
+            if x <= (x1+x2)/2 <= x+w and y <= (y1+y2)/2 <= y+h:
+                result.append(i)
+        return result
+
+    def getText(self, indexes):
+        """ returns text of the words, keeping line breaks """
+        text = ""
+        for n,i in enumerate(indexes):
+            if n>0:
+                text += " " if self.line_nos[i]==self.line_nos[indexes[n-1]] else "\n"
+            text += self.words[i]
+        return text
+
+    def wordRects(self, indexes):
+        """ returns list of [x,y,w,h] rects, one for each line of the words """
+        return self._lineRects([(i, 0, len(self.words[i])) for i in indexes])
+
+    def findText(self, text):
+        """ case insensitive search. returns list of [x,y,w,h] rects """
+        text = " ".join(text.split()).lower()
+        if not text:
+            return []
+        # replacing newline by space keeps offsets unchanged
+        page_text = self.text.replace("\n", " ").lower()
+        result = []
+        start = page_text.find(text)
+        while start>=0:
+            end = start + len(text)
+            first = bisect_right(self.offsets, start) - 1
+            last = bisect_right(self.offsets, end-1) - 1
+            spans = []
+            for i in range(first, last+1):
+                span_start = max(start - self.offsets[i], 0)
+                span_end = min(end - self.offsets[i], len(self.words[i]))
+                if span_end>span_start:
+                    spans.append((i, span_start, span_end))
+            result += self._lineRects(spans)
+            start = page_text.find(text, end)
+        return result
+
+    def _lineRects(self, spans):
+        """ spans is list of (word_index, char_start, char_end). Part of the word
+        box is taken in proportion to the no. of chars """
+        lines = {}
+        for i, start, end in spans:
+            x1,y1,x2,y2 = self.wordBox(i)
+            char_w = (x2-x1)/max(len(self.words[i]), 1)
+            x1, x2 = x1 + start*char_w, x1 + end*char_w
+            line_no = self.line_nos[i]
+            if line_no in lines:
+                X1,Y1,X2,Y2 = lines[line_no]
+                x1,y1,x2,y2 = min(x1,X1), min(y1,Y1), max(x2,X2), max(y2,Y2)
+            lines[line_no] = x1,y1,x2,y2
+        return [[x1,y1,x2-x1,y2-y1] for x1,y1,x2,y2 in lines.values()]
+
+
+# load default backend
+for backend, import_func in backends:
+    if loadBackend(backend):
+        break
+backend_version = backend_versions.get(backend, "")
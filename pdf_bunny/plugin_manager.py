@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 import importlib.util
 import os
+import json
+import time
 import traceback
+from functools import partial
 
-from PyQt5.QtCore import QStandardPaths
+from PyQt5.QtCore import QStandardPaths, QObject, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QMessageBox
+
+from image_filters import imageArray
 
 
 PLUGIN_DIR =  QStandardPaths.writableLocation(QStandardPaths.AppDataLocation) + "/PDF_Bunny/plugins"
@@ -18,19 +24,178 @@ def import_from_path(module_name, file_path):
     return module
 
 
+class PluginInfo:
+    """ A plugin file and its manifest. If plugin.py has a plugin.json manifest
+    like this, it is imported only when one of its menu actions is triggered
+    or one of the events occurs.
+    {
+        "name" : "Word Counter",
+        "description" : "Counts words in document",
+        "menu" : [{"title" : "Count Words", "method" : "countWords"}],
+        "events" : ["fileOpened"]
+    }
+    method is called on the plugin object registered by the module. The plugin
+    must not add these menu actions itself. Plugins without manifest are
+    imported at startup. """
+    def __init__(self, filename, manifest):
+        self.filename = filename
+        self.name = manifest.get("name", os.path.basename(filename)[:-3])
+        self.description = manifest.get("description", "")
+        self.menu = manifest.get("menu", [])
+        self.events = manifest.get("events", [])
+        self.plugins = [] # Plugin objects registered by module
+        self.loaded = False
+        self.failed = False
+        self.load_time = 0.0 # time taken to import and initialize in seconds
+
+    def load(self):
+        """ imports the module if not imported yet. returns True on success """
+        global loading_plugin
+        if self.loaded or self.failed:
+            return self.loaded
+        loading_plugin = self
+        start = time.perf_counter()
+        try:
+            import_from_path(os.path.basename(self.filename)[:-3], self.filename)
+            self.loaded = True
+        except:
+            print(traceback.format_exc())
+            print("Failed to load plugin : ", self.filename)
+            self.failed = True
+        self.load_time = time.perf_counter() - start
+        loading_plugin = None
+        return self.loaded
+
+
+plugin_infos = []
+loading_plugin = None # PluginInfo of module being imported
+
+
 def loadPlugins(app):
+    """ imports plugins without manifest, and adds menu actions of others """
     if not os.path.exists(PLUGIN_DIR):
         return
     global App
     App = app
     files = [f for f in os.listdir(PLUGIN_DIR) if f.endswith(".py")]
     files = [f for f in files if os.path.isfile(PLUGIN_DIR +"/"+f)]# filter files only
-    for i,filename in enumerate(files):
-        try:
-            import_from_path(filename[:-3], PLUGIN_DIR +"/"+filename)
-        except:
-            print(traceback.format_exc())
-            print("Failed to load plugin : ", filename)
+    for filename in sorted(files):
+        manifest = None
+        manifest_file = PLUGIN_DIR + "/" + filename[:-3] + ".json"
+        if os.path.isfile(manifest_file):
+            try:
+                with open(manifest_file) as f:
+                    manifest = json.load(f)
+                checkManifest(manifest)
+            except:
+                print(traceback.format_exc())
+                print("Invalid plugin manifest : ", manifest_file)
+                continue
+        info = PluginInfo(PLUGIN_DIR + "/" + filename, manifest or {})
+        plugin_infos.append(info)
+        if manifest is None:
+            info.load()
+            continue
+        for entry in info.menu:
+            App.window.pluginsMenu.addAction(entry["title"], partial(runPluginAction, info, entry["method"]))
+    if plugin_infos:
+        App.window.fileOpened.connect(onFileOpened)
+        App.window.pluginsMenu.addSeparator()
+        App.window.pluginsMenu.addAction("Plugin Load Times", showPluginLoadTimes)
+
+
+def checkManifest(manifest):
+    """ raises ValueError if manifest is not in the format shown in PluginInfo """
+    if not isinstance(manifest, dict):
+        raise ValueError("manifest must be an object")
+    for key in ("name", "description"):
+        if not isinstance(manifest.get(key, ""), str):
+            raise ValueError("%s must be a string" % key)
+    menu = manifest.get("menu", [])
+    if not isinstance(menu, list) or not all(isinstance(entry, dict) and
+            isinstance(entry.get("title"), str) and isinstance(entry.get("method"), str) for entry in menu):
+        raise ValueError("menu must be a list of {title, method} objects")
+    events = manifest.get("events", [])
+    if not isinstance(events, list) or not all(isinstance(event, str) for event in events):
+        raise ValueError("events must be a list of strings")
+
+
+def runPluginAction(info, method):
+    if not info.load():
+        return
+    for plugin in info.plugins:
+        if hasattr(plugin, method):
+            getattr(plugin, method)()
+            return
+
+def onFileOpened(filename):
+    """ loads plugins waiting for fileOpened event """
+    for info in plugin_infos:
+        if "fileOpened" in info.events and not info.loaded and info.load():
+            # plugins connected to fileOpened now, will get next events
+            for plugin in info.plugins:
+                plugin.onFileOpen(filename)
+
+def showPluginLoadTimes():
+    lines = []
+    for info in sorted(plugin_infos, key=lambda info: -info.load_time):
+        if info.loaded:
+            status = "%.1f ms" % (info.load_time*1000)
+        else:
+            status = "failed" if info.failed else "not loaded"
+        lines.append("%s : %s" % (info.name, status))
+    QMessageBox.information(App.window, "Plugin Load Times", "\n".join(lines))
+
+
+class Job(QObject):
+    """ Returned by async methods of Plugin. Its tasks are run by worker threads.
+    progress(done, total) is emitted after each page is done, and finished(result)
+    is emitted when all pages are done. result is the result of the page for single
+    page jobs, and {page_no : result} dict for batch jobs. result of a page is None
+    if it failed. Repeated page_nos are done once, and a job without pages is
+    finished as soon as the event loop runs. Job has no parent, so it is deleted
+    with its results when plugin does not keep it and its tasks are done. """
+    finished = pyqtSignal(object)
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, manager, page_nos, batch):
+        QObject.__init__(self)
+        self.manager = manager
+        self.page_nos = list(dict.fromkeys(page_nos))
+        self.total = len(self.page_nos)
+        self.batch = batch
+        self.results = {}
+        self.cancelled = False
+
+    def isDone(self):
+        return len(self.results)==self.total
+
+    def result(self):
+        """ returns result, or None if the job is not done yet """
+        if not self.isDone():
+            return None
+        if self.batch:
+            return self.results
+        return next(iter(self.results.values()), None)
+
+    def cancel(self):
+        """ remove tasks which are not started yet. finished is not emitted """
+        self.cancelled = True
+        self.manager.cancel_job(self)
+        self.results = {}
+
+    def taskFinished(self, page_no, result):
+        """ called by Manager """
+        if self.cancelled:
+            return
+        self.results[page_no] = result
+        self.progress.emit(len(self.results), self.total)
+        if self.isDone():
+            self.finished.emit(self.result())
+
+    def finishEmpty(self):
+        if not self.cancelled:
+            self.finished.emit(self.result())
 
 
 class Plugin():
@@ -46,8 +211,46 @@ class Plugin():
         return self.app.filename
 
     def renderPage(self, page_no, dpi):
+        """ renders in caller's thread. renderPageAsync() does not block gui """
         return self.app.doc.renderPage(page_no, dpi)
 
+    def submitJob(self, kind, page_nos, arg=None, batch=True):
+        """ kind is "render", "text" or "search". returns Job """
+        job = Job(self.app.manager, page_nos, batch)
+        if not job.page_nos:
+            # emitted after the caller has connected to finished
+            QTimer.singleShot(0, job.finishEmpty)
+            return job
+        self.app.manager.submit_job(job, kind, job.page_nos, arg)
+        return job
+
+    def renderPageAsync(self, page_no, dpi, color_mode="color"):
+        """ result is QImage. Already rendered pages are reused """
+        return self.submitJob("render", [page_no], (dpi, color_mode), False)
+
+    def renderPages(self, page_nos, dpi, color_mode="color"):
+        return self.submitJob("render", page_nos, (dpi, color_mode))
+
+    def textLayerAsync(self, page_no):
+        """ result is TextLayer of the page """
+        return self.submitJob("text", [page_no], None, False)
+
+    def textLayers(self, page_nos):
+        return self.submitJob("text", page_nos)
+
+    def findTextAsync(self, page_no, text):
+        """ result is list of [x,y,w,h] rects in points """
+        return self.submitJob("search", [page_no], text, False)
+
+    def findTextInPages(self, page_nos, text):
+        return self.submitJob("search", page_nos, text)
+
+    @staticmethod
+    def imageArray(image):
+        """ returns a read-only numpy array which uses the QImage data without
+        copying. see image_filters.imageArray() """
+        return imageArray(image)
+
     def onFileOpen(self, filename):
         """ connected to fileOpened signal of window """
         pass
@@ -57,5 +260,7 @@ def register_plugin(PluginClass):
     try:
         plugin = PluginClass(App)
         App.plugins.append(plugin)# storing it prevents getting deleted by python
+        if loading_plugin:
+            loading_plugin.plugins.append(plugin)
     except:
         print(traceback.format_exc())
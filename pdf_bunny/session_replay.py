@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is a part of PDF Bunny Program which is GNU GPLv3 licensed
+""" Records user sessions and replays them to measure interactive latency.
+
+Record a session :
+    pdf_bunny --record-session session.jsonl file.pdf
+Replay it headlessly and print metrics :
+    python3 session_replay.py session.jsonl
+
+Session file has one json list per line, [time, event, args...].
+First line is ["header", width, height, zoom_index]. Events are "open",
+"tab", "resize", "zoom", "scroll", "jump" and "find".
+
+While replaying, visible pages are checked on every frame (60 per second).
+A frame is blank if any visible page has no image, and dropped if the event
+loop was too busy to check it in time. Latency of an event is the time until
+the first frame after it where all visible pages have images.
+"""
+import sys, os
+import json
+import time
+import tempfile
+
+from PyQt5.QtCore import Qt, QObject, QEvent, QTimer, QSettings
+
+FRAME_INTERVAL = 1/60
+SETTLE_TIME = 2 # seconds to wait for pending events after last event
+
+
+class SessionRecorder(QObject):
+    """ writes user actions on window to a session file """
+    def __init__(self, window, filename):
+        QObject.__init__(self, window)
+        self.window = window
+        self.file = open(filename, "w")
+        self.start_time = time.monotonic()
+        self.writeLine(["header", window.width(), window.height(), window.zoomLevelCombo.currentIndex()])
+        window.fileOpened.connect(lambda filename: self.record("open", filename))
+        window.tabBar.currentChanged.connect(lambda index: self.record("tab", index))
+        window.zoomLevelCombo.activated.connect(lambda index: self.record("zoom", index))
+        window.scrollArea.verticalScrollBar().valueChanged.connect(lambda pos: self.record("scroll", pos))
+        window.pageJumped.connect(lambda page_no, top: self.record("jump", page_no, top))
+        window.textSearched.connect(lambda text, direction: self.record("find", text, direction))
+        window.installEventFilter(self)
+
+    def eventFilter(self, obj, ev):
+        if ev.type()==QEvent.Resize:
+            self.record("resize", ev.size().width(), ev.size().height())
+        return False
+
+    def record(self, event, *args):
+        self.writeLine([round(time.monotonic()-self.start_time, 4), event] + list(args))
+
+    def writeLine(self, line):
+        self.file.write(json.dumps(line) + "\n")
+        self.file.flush()# so that session is kept if program crashes
+
+
+class SessionPlayer(QObject):
+    """ replays a recorded session on window, and collects frame metrics """
+    def __init__(self, window, filename):
+        QObject.__init__(self, window)
+        self.window = window
+        with open(filename) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        header, self.events = lines[0], lines[1:]
+        width, height, zoom = header[1:4]
+        window.resize(width, height)
+        window.zoomLevelCombo.setCurrentIndex(zoom)
+        self.frames, self.blank_frames, self.draft_frames, self.dropped_frames = 0, 0, 0, 0
+        self.pending = [] # [event, time] of events whose pages are not shown yet
+        self.latencies = {} # {event : [seconds]} dictionary
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.onFrame)
+
+    def play(self):
+        """ blocks until all events are replayed and pages are shown """
+        from main import wait
+        self.start_time = self.last_frame_time = time.monotonic()
+        self.end_time = self.start_time + (self.events[-1][0] if self.events else 0) + SETTLE_TIME
+        self.timer.start(int(FRAME_INTERVAL*1000))
+        while self.timer.isActive():
+            wait(100)
+
+    def onFrame(self):
+        now = time.monotonic()
+        elapsed = now - self.start_time
+        self.dropped_frames += max(int((now-self.last_frame_time)/FRAME_INTERVAL) - 1, 0)
+        self.last_frame_time = now
+        while self.events and self.events[0][0]<=elapsed:
+            self.runEvent(*self.events.pop(0)[1:])
+        # events may take long, e.g opening a file
+        now = time.monotonic()
+        # page images set in this frame are painted after this function returns
+        self.frames += 1
+        blank, draft = self.visiblePagesState()
+        self.blank_frames += blank
+        self.draft_frames += draft
+        if not blank:
+            for event, start in self.pending[:]:
+                if event=="find" and not self.window.search_result_page:
+                    continue
+                self.latencies.setdefault(event, []).append(now-start)
+                self.pending.remove([event, start])
+        if now>self.end_time or (not self.events and not self.pending and now>self.end_time-SETTLE_TIME):
+            self.timer.stop()
+
+    def runEvent(self, event, *args):
+        win = self.window
+        scrollbar = win.scrollArea.verticalScrollBar()
+        if event=="scroll" and (scrollbar.value()==args[0] or not win.pages):
+            return # jumps and zoom also scroll
+        start = time.monotonic()
+        if event=="open":
+            win.loadPDFfile(args[0])
+        elif event=="tab":
+            win.tabBar.setCurrentIndex(args[0])
+        elif event=="resize":
+            win.resize(*args)
+        elif event=="zoom":
+            win.zoomLevelCombo.setCurrentIndex(args[0])
+            win.setZoom(args[0])
+        elif event=="scroll":
+            scrollbar.setValue(args[0])
+        elif event=="jump":
+            win.jumpToPage(*args)
+        elif event=="find":
+            win.findTextEdit.setText(args[0])
+            win.findText(*args)
+        self.pending.append([event, start])
+
+    def visiblePagesState(self):
+        """ returns whether any visible page is blank, and any is a draft """
+        from main import isDraft
+        visible = [page for page in self.window.pages if not page.visibleRegion().isEmpty()]
+        blank = any(page.image.isNull() for page in visible)
+        draft = any(isDraft(page.image) for page in visible if not page.image.isNull())
+        return blank, draft
+
+    def report(self):
+        """ returns metrics as dict. latencies are in milliseconds """
+        result = {"frames": self.frames, "blank_frames": self.blank_frames,
+                "draft_frames": self.draft_frames, "dropped_frames": self.dropped_frames,
+                "unfinished_events": len(self.pending), "latency": {}}
+        all_latencies = []
+        for event, latencies in sorted(self.latencies.items()):
+            result["latency"][event] = latencyStats(latencies)
+            all_latencies += latencies
+        result["latency"]["all"] = latencyStats(all_latencies)
+        return result
+
+
+def latencyStats(latencies):
+    """ returns count, mean, median, 95 percentile and max of latencies in ms """
+    values = sorted(x*1000 for x in latencies)
+    if not values:
+        return {"count": 0}
+    return {"count": len(values), "mean": round(sum(values)/len(values), 1),
+            "median": round(values[len(values)//2], 1),
+            "p95": round(values[min(int(len(values)*0.95), len(values)-1)], 1),
+            "max": round(values[-1], 1)}
+
+
+def printReport(result):
+    print("Frames : %i, blank : %i, draft : %i, dropped : %i" % (result["frames"],
+            result["blank_frames"], result["draft_frames"], result["dropped_frames"]))
+    if result["unfinished_events"]:
+        print("Events not finished : %i" % result["unfinished_events"])
+    print("Latency (ms)  count    mean  median     p95     max")
+    for event, stats in result["latency"].items():
+        if stats["count"]:
+            print("%-12s %6i %7.1f %7.1f %7.1f %7.1f" % (event, stats["count"], stats["mean"],
+                        stats["median"], stats["p95"], stats["max"]))
+
+
+def replay(filename):
+    """ replays session in a new window, using default settings """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    sys.path.append(os.path.dirname(__file__))
+    from PyQt5.QtWidgets import QApplication
+    from main import Window
+    # settings of user are neither used nor modified
+    with tempfile.TemporaryDirectory(prefix="pdf-bunny-replay-") as settings_dir:
+        QSettings.setPath(QSettings.NativeFormat, QSettings.UserScope, settings_dir)
+        QSettings.setPath(QSettings.IniFormat, QSettings.UserScope, settings_dir)
+        app = QApplication(sys.argv[:1])
+        win = Window()
+        player = SessionPlayer(win, filename)
+        player.play()
+        result = player.report()
+        win.onAppQuit()
+        app.quit()
+    return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv)<2:
+        print("usage : session_replay.py [--json] SESSION_FILE")
+        sys.exit(1)
+    result = replay(sys.argv[-1])
+    if "--json" in sys.argv:
+        print(json.dumps(result, indent=2))
+    else:
+        printReport(result)